@@ -0,0 +1,406 @@
+"""Benchmarks of parsing and chart preparation on synthetic .FIT files.
+
+Every benchmark is timed in its own spawned process. Its peak memory is
+measured in another fresh process over one run of the measured code after a
+warm-up run, with `tracemalloc` for Python objects and, on Linux, with the
+peak resident memory reset before the run, which includes memory allocated
+by polars and arrow. The results are compared to `baselines.json` and the run fails if a
+throughput drops or a peak memory grows by more than the tolerance.
+
+    python -m benchmarks.run                # run and compare
+    python -m benchmarks.run --only pipes   # run a subset
+    python -m benchmarks.run --update       # store new baselines
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from wahoosnowmaker.namespace import Namespace
+from wahoosnowmaker.utils.synthetic_fit import write_fit_file
+
+BASELINES = Path(__file__).parent / "baselines.json"
+
+# A benchmark prepares its input and returns a function that runs the
+# measured code once and returns the number of records it processed.
+Benchmark = Callable[[str], Callable[[], int]]
+
+
+def _fitfiles(folder: str) -> list[str]:
+    return sorted(str(path) for path in Path(folder).glob("*.fit"))
+
+
+def _parser(name: str):
+    from wahoosnowmaker.parser.fitparser import (
+        ColumnarFitParser,
+        GarminFitSDKParser,
+    )
+
+    return {"garmin": GarminFitSDKParser, "columnar": ColumnarFitParser}[name]()
+
+
+def bench_parser(name: str) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        parser, fitfile = _parser(name), _fitfiles(folder)[0]
+        return lambda: parser.fit_to_records_df(fitfile).collect().height
+
+    return setup
+
+
+def bench_pipe(name: str) -> Benchmark:
+    from wahoosnowmaker.parser import pipes
+
+    steps = [
+        ("make_column_names_consistent", pipes.make_column_names_consistent),
+        ("parse_timestamp", pipes.parse_timestamp),
+        ("convert_semicircles_to_lat_lon", pipes.convert_semicircles_to_lat_lon),
+        ("compute_elapsed_seconds", pipes.compute_elapsed_seconds),
+        ("enforce_schema", pipes.enforce_schema),
+        ("assign_file", lambda lf: pipes.assign_file(lf, file_id=0)),
+        ("name_files", lambda lf: pipes.name_files(lf, ["synthetic.fit"])),
+    ]
+
+    def setup(folder: str) -> Callable[[], int]:
+        df = _parser("columnar").fit_to_records_df(_fitfiles(folder)[0]).collect()
+        if name == "drop_columns_all_nans":
+            return lambda: pipes.drop_columns_all_nans(df).height
+        for step_name, step in steps:
+            if step_name == name:
+                return lambda: step(df.lazy()).collect().height
+            df = step(df.lazy()).collect()
+        raise ValueError(f"Unknown pipe {name}")
+
+    return setup
+
+
+def bench_align(on: str, method: str) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        from wahoosnowmaker.parser.pipes import align_files
+
+        df = _analysis_frame(folder)
+        resolution = Namespace.alignment_resolution[on]
+
+        def run() -> int:
+            align_files(df.lazy(), resolution, on, method).collect()
+            return len(df)
+
+        return run
+
+    return setup
+
+
+def bench_parse_folder(name: str, cached: bool = False) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        from wahoosnowmaker.parser.parse_folder import parse_folder
+
+        parser = _parser(name)
+        if cached:
+            parse_folder(folder, parser=parser)
+        return lambda: parse_folder(folder, parser=parser, use_cache=cached).height
+
+    return setup
+
+
+def _analysis_frame(folder: str):
+    from wahoosnowmaker.parser.parse_folder import parse_folder
+
+    return parse_folder(folder, parser=_parser("columnar"), use_cache=False)
+
+
+def bench_chart(method: str) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        from wahoosnowmaker.app.viz.chartsplotly import build_chart_figure
+
+        df = _analysis_frame(folder)
+        fields = [f for f in Namespace.standard_charts_to_display if f in df.columns]
+
+        def run() -> int:
+            build_chart_figure(df, fields, Namespace.default_chart_points, method)
+            return len(df)
+
+        return run
+
+    return setup
+
+
+def bench_map(color_by: str) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        from wahoosnowmaker.app.viz.chartsplotly import build_map_figure
+
+        df = _analysis_frame(folder)
+
+        def run() -> int:
+            build_map_figure(df, color_attribute=color_by)
+            return len(df)
+
+        return run
+
+    return setup
+
+
+def bench_map_style(folder: str) -> Callable[[], int]:
+    import plotly.graph_objects as go
+
+    from wahoosnowmaker.app.viz.chartsplotly import (
+        build_map_traces,
+        style_map_figure,
+    )
+
+    df = _analysis_frame(folder)
+    traces = build_map_traces(df, Namespace.column_heartrate)
+
+    def run() -> int:
+        # like `show_map`, which styles a copy of the cached traces
+        style_map_figure(go.Figure(traces), "open-street-map", "plasma")
+        return len(df)
+
+    return run
+
+
+def bench_simplify_tracks(folder: str) -> Callable[[], int]:
+    from wahoosnowmaker.app.viz.track_simplification import simplify_tracks
+
+    df = _analysis_frame(folder)
+
+    def run() -> int:
+        simplify_tracks(df, zoom=14)
+        return len(df)
+
+    return run
+
+
+def bench_scatter_density(color_by: str) -> Benchmark:
+    def setup(folder: str) -> Callable[[], int]:
+        from wahoosnowmaker.app.viz.chartsplotly import build_density_figure
+        from wahoosnowmaker.app.viz.density import bin_2d
+
+        df = _analysis_frame(folder)
+        x, y = Namespace.column_heartrate, Namespace.column_power
+
+        def run() -> int:
+            density = bin_2d(df, x, y, color_by, Namespace.scatter_density_bins)
+            build_density_figure(density, x, y, color_by)
+            return len(df)
+
+        return run
+
+    return setup
+
+
+def bench_describe(folder: str) -> Callable[[], int]:
+    from wahoosnowmaker.parser.statistics import describe_by
+
+    df = _analysis_frame(folder)
+
+    def run() -> int:
+        describe_by(df)
+        return len(df)
+
+    return run
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "parser.garmin": bench_parser("garmin"),
+    "parser.columnar": bench_parser("columnar"),
+    **{
+        f"pipes.{name}": bench_pipe(name)
+        for name in [
+            "make_column_names_consistent",
+            "parse_timestamp",
+            "convert_semicircles_to_lat_lon",
+            "compute_elapsed_seconds",
+            "enforce_schema",
+            "assign_file",
+            "name_files",
+            "drop_columns_all_nans",
+        ]
+    },
+    "pipes.align_files.linear": bench_align(Namespace.column_elapsed_time, "linear"),
+    "pipes.align_files.nearest": bench_align(Namespace.column_elapsed_time, "nearest"),
+    "pipes.align_files.distance": bench_align(Namespace.column_distance, "linear"),
+    "parse_folder.garmin": bench_parse_folder("garmin"),
+    "parse_folder.columnar": bench_parse_folder("columnar"),
+    "parse_folder.cached": bench_parse_folder("columnar", cached=True),
+    "statistics.describe_by": bench_describe,
+    "chart.build_chart_figure": bench_chart("none"),
+    "chart.build_chart_figure.min-max": bench_chart("min-max"),
+    "chart.build_chart_figure.lttb": bench_chart("lttb"),
+    "scatter.density.file": bench_scatter_density(Namespace.column_file),
+    "scatter.density.speed": bench_scatter_density(Namespace.column_speed),
+    "map.simplify_tracks": bench_simplify_tracks,
+    "map.build_map_figure.file": bench_map(Namespace.column_file),
+    "map.build_map_figure.heartrate": bench_map(Namespace.column_heartrate),
+    "map.style_map_figure": bench_map_style,
+}
+
+
+# polars' jemalloc returns freed pages at once, so that pages kept for reuse
+# after the warm-up run do not hide the memory of the measured run
+MEMORY_ENVIRONMENT = {"_RJEM_MALLOC_CONF": "dirty_decay_ms:0,muzzy_decay_ms:0"}
+
+
+def _memory_mb(field: str) -> float:
+    # e.g. "VmRSS:     1234 kB"
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1]) / 2**10
+    raise KeyError(field)
+
+
+def _reset_peak_rss() -> bool:
+    """Resets the peak resident memory of this process, if the OS can."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def _time(name: str, folder: str, repeat: int) -> dict[str, float]:
+    run = BENCHMARKS[name](folder)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_records = run()
+        seconds.append(time.perf_counter() - start)
+    return {"records_per_second": round(n_records / min(seconds))}
+
+
+def _peak_memory(name: str, folder: str) -> dict[str, float]:
+    run = BENCHMARKS[name](folder)
+    # e.g. plotly imports its validators on first use
+    run()
+    gc.collect()
+    native = _reset_peak_rss()
+    if native:
+        rss_before = _memory_mb("VmRSS")
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    if native:
+        peak = max(peak, _memory_mb("VmHWM") - rss_before)
+    return {"peak_mb": round(peak, 1)}
+
+
+def _in_child(task: Callable[..., dict], args: tuple, queue) -> None:
+    try:
+        queue.put(task(*args))
+    except Exception as e:
+        queue.put(f"{type(e).__name__}: {e}")
+
+
+def _run_in_child(
+    task: Callable[..., dict], args: tuple, environment: dict[str, str] | None = None
+) -> dict[str, float]:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_in_child, args=(task, args, queue))
+    # the spawned process inherits the environment when it starts
+    previous = os.environ.copy()
+    os.environ.update(environment or {})
+    try:
+        process.start()
+    finally:
+        os.environ.clear()
+        os.environ.update(previous)
+    result = queue.get()
+    process.join()
+    if isinstance(result, str):
+        raise RuntimeError(f"Benchmark {args[0]} failed: {result}")
+    return result
+
+
+def measure(name: str, folder: str, repeat: int) -> dict[str, float]:
+    """Times a benchmark and measures its peak memory, each in a fresh process."""
+    timing = _run_in_child(_time, (name, folder, repeat))
+    return timing | _run_in_child(_peak_memory, (name, folder), MEMORY_ENVIRONMENT)
+
+
+def compare(
+    name: str, result: dict[str, float], baseline: dict | None, tolerance: float
+) -> list[str]:
+    """Returns the regressions of a result against its baseline."""
+    if baseline is None:
+        return []
+    regressions = []
+    if result["records_per_second"] < (1 - tolerance) * baseline["records_per_second"]:
+        regressions.append(
+            f"{name}: {result['records_per_second']:,.0f} records/s, "
+            f"baseline {baseline['records_per_second']:,.0f}"
+        )
+    # small absolute slack for benchmarks that allocate almost nothing
+    if result["peak_mb"] > (1 + tolerance) * baseline["peak_mb"] + 1:
+        regressions.append(
+            f"{name}: {result['peak_mb']:.1f} MB peak, "
+            f"baseline {baseline['peak_mb']:.1f} MB"
+        )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20_000)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--sample-rate", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--only", default="", help="run benchmarks containing this")
+    parser.add_argument("--update", action="store_true", help="store new baselines")
+    args = parser.parse_args()
+
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    setup = {
+        "records": args.records,
+        "files": args.files,
+        "sample_rate": args.sample_rate,
+    }
+    if baselines.get("setup", setup) != setup:
+        print(f"Baselines were recorded for {baselines['setup']}, not comparing.")
+        baselines = {}
+
+    results, regressions, failures = {}, [], []
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(args.files):
+            write_fit_file(
+                os.path.join(folder, f"synthetic_{i}.fit"),
+                n_records=args.records,
+                sample_rate=args.sample_rate,
+                start=1_000_000_000 + i * 86_400,
+            )
+        for name in BENCHMARKS:
+            if args.only not in name:
+                continue
+            try:
+                results[name] = measure(name, folder, args.repeat)
+            except RuntimeError as e:
+                print(e)
+                failures.append(name)
+                continue
+            print(
+                f"{name:<45} {results[name]['records_per_second']:>14,.0f} records/s"
+                f" {results[name]['peak_mb']:>9.1f} MB"
+            )
+            baseline = baselines.get("benchmarks", {}).get(name)
+            regressions += compare(name, results[name], baseline, args.tolerance)
+
+    if args.update:
+        stored = baselines.get("benchmarks", {}) | results
+        BASELINES.write_text(
+            json.dumps({"setup": setup, "benchmarks": stored}, indent=2) + "\n"
+        )
+        regressions = []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if len(regressions) > 0 or len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
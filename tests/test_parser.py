@@ -0,0 +1,305 @@
+"""Tests for `wahoosnowmaker.parser` on synthetic .FIT files."""
+import glob
+import os
+import struct
+import time
+
+import numpy as np
+import polars as pl
+import pytest
+
+from wahoosnowmaker.namespace import Namespace
+from wahoosnowmaker.parser.cache import (
+    CacheSchemaError,
+    cache_file,
+    cache_key,
+    save_cached_batches,
+)
+from wahoosnowmaker.parser.dataset import Dataset
+from wahoosnowmaker.parser.fitdecoder import iter_records
+from wahoosnowmaker.parser.fitparser import (
+    ColumnarFitParser,
+    GarminFitSDKParser,
+)
+from wahoosnowmaker.parser.parse_folder import (
+    parse_file,
+    parse_folder,
+    stream_file_to_cache,
+)
+from wahoosnowmaker.parser.pipes import align_files
+from wahoosnowmaker.parser.records_naming_mapping import ColumnSchema
+from wahoosnowmaker.parser.spatial_index import SpatialIndex
+from wahoosnowmaker.utils.synthetic_fit import write_fit_file
+
+
+@pytest.mark.parametrize("arch", [0, 1])
+def test_parsers_agree(tmp_path, arch) -> None:
+    fitfile = str(tmp_path / "activity.fit")
+    write_fit_file(fitfile, n_records=1200, sample_rate=2, arch=arch)
+    garmin = GarminFitSDKParser().fit_to_records_df(fitfile).collect()
+    columnar = ColumnarFitParser().fit_to_records_df(fitfile).collect()
+    assert garmin.height == columnar.height == 1200
+    for column in columnar.columns:
+        assert (
+            garmin[column]
+            .cast(pl.Float64, strict=False)
+            .series_equal(
+                columnar[column].cast(pl.Float64, strict=False), null_equal=True
+            )
+        ), column
+
+
+@pytest.mark.parametrize("parser", [GarminFitSDKParser(), ColumnarFitParser()])
+def test_parsed_columns_have_declared_dtypes(tmp_path, parser) -> None:
+    write_fit_file(str(tmp_path / "a.fit"), n_records=100, fields=["heart_rate"])
+    write_fit_file(
+        str(tmp_path / "b.fit"), n_records=100, fields=["power", "speed", "altitude"]
+    )
+    frames = [
+        parse_file(str(tmp_path / name), parser, use_cache=False)
+        for name in ["a.fit", "b.fit"]
+    ]
+    for df in frames:
+        assert df.schema == {column: ColumnSchema[column] for column in df.columns}
+    assert frames[0]["Heartrate [bpm]"].dtype == pl.Int16
+    assert frames[1]["Power [W]"].dtype == pl.Int16
+    assert frames[1]["Speed [mps]"].dtype == pl.Float32
+    assert frames[1]["Elapsed time [s]"].dtype == pl.Int32
+    # files with different fields are concatenated without promoting a column
+    assert pl.concat(frames, how="diagonal").schema == {
+        **frames[0].schema,
+        **frames[1].schema,
+    }
+
+
+@pytest.mark.parametrize("parser", [GarminFitSDKParser(), ColumnarFitParser()])
+def test_parse_folder_columns(tmp_path, parser) -> None:
+    write_fit_file(str(tmp_path / "a.fit"), n_records=100)
+    columns = ["Latitude [°]"]
+    parsed = parse_folder(str(tmp_path), parser=parser, columns=columns)
+    assert set(parsed.columns) == {
+        "Timestamp",
+        "Elapsed time [s]",
+        "Latitude [°]",
+        "file",
+    }
+    assert parsed["Latitude [°]"].is_between(47.9, 48.1).all()
+    # written by the full parse, read partially
+    full = parse_folder(str(tmp_path), parser=parser)
+    cached = parse_folder(str(tmp_path), parser=parser, columns=columns)
+    assert cached.with_columns(pl.col("file").cast(pl.Utf8)).frame_equal(
+        parsed.select(cached.columns).with_columns(pl.col("file").cast(pl.Utf8)),
+        null_equal=True,
+    )
+    assert cached["Latitude [°]"].series_equal(full["Latitude [°]"])
+
+
+def test_compressed_timestamps(tmp_path) -> None:
+    # the Garmin SDK does not decode compressed timestamps, compare to the
+    # same file with full timestamps instead
+    for compressed in [False, True]:
+        write_fit_file(
+            str(tmp_path / f"{compressed}.fit"),
+            n_records=1200,
+            sample_rate=2,
+            arch=1,
+            compressed_timestamps=compressed,
+        )
+    parser = ColumnarFitParser()
+    full = parser.fit_to_records_df(str(tmp_path / "False.fit")).collect()
+    compressed = parser.fit_to_records_df(str(tmp_path / "True.fit")).collect()
+    assert compressed["timestamp"].null_count() == 0
+    assert compressed.frame_equal(full, null_equal=True)
+
+
+def test_corrupt_file_raises_its_error(tmp_path) -> None:
+    fitfile = str(tmp_path / "activity.fit")
+    write_fit_file(fitfile, n_records=1200)
+    with open(fitfile, "rb") as f:
+        data = f.read()
+    # truncated in different parts of a record
+    for end in range(len(data) // 2, len(data) // 2 + 40):
+        with open(fitfile, "wb") as f:
+            f.write(data[:end])
+        with pytest.raises((IndexError, struct.error)):
+            for _ in iter_records(fitfile, batch_size=100):
+                pass
+
+
+def test_parse_folder_cache(tmp_path) -> None:
+    for i in range(2):
+        write_fit_file(os.path.join(tmp_path, f"{i}.fit"), n_records=100)
+    parsed = parse_folder(str(tmp_path), parser=ColumnarFitParser())
+    cached = parse_folder(str(tmp_path), parser=ColumnarFitParser())
+    assert parsed.height == 200
+    assert parsed["Latitude [°]"].is_between(47.9, 48.1).all()
+    assert parsed.with_columns(pl.col("file").cast(pl.Utf8)).frame_equal(
+        cached.with_columns(pl.col("file").cast(pl.Utf8)), null_equal=True
+    )
+
+
+def test_streamed_parse_equals_parse(tmp_path) -> None:
+    for i in range(2):
+        write_fit_file(os.path.join(tmp_path, f"{i}.fit"), n_records=1000)
+    # is skipped like a file that fails to parse
+    write_fit_file(os.path.join(tmp_path, "empty.fit"), n_records=0)
+    parser = ColumnarFitParser()
+    parsed = parse_folder(str(tmp_path), parser=parser, use_cache=False)
+    streamed = parse_folder(str(tmp_path), parser=parser, batch_size=128)
+    assert streamed.height == 2000
+    assert streamed.with_columns(pl.col("file").cast(pl.Utf8)).frame_equal(
+        parsed.with_columns(pl.col("file").cast(pl.Utf8)), null_equal=True
+    )
+    empty = os.path.join(tmp_path, "empty.fit")
+    assert stream_file_to_cache(empty, parser, batch_size=128) is None
+    fitfile = os.path.join(tmp_path, "0.fit")
+    path = stream_file_to_cache(fitfile, parser, batch_size=128)
+    assert path == cache_file(fitfile, cache_key(fitfile, parser))
+    assert pl.read_parquet(path).frame_equal(
+        parse_file(fitfile, parser, use_cache=False), null_equal=True
+    )
+
+
+class _PowerAfterFirstBatchParser(ColumnarFitParser):
+    def _iter_record_batches(self, fit_file, batch_size, columns):
+        batches = super()._iter_record_batches(fit_file, batch_size, columns)
+        yield next(batches).drop("power")
+        yield from batches
+
+
+def test_streaming_falls_back_when_a_batch_adds_a_column(tmp_path) -> None:
+    fitfile = str(tmp_path / "activity.fit")
+    write_fit_file(fitfile, n_records=1000)
+    parser = _PowerAfterFirstBatchParser()
+    key = cache_key(fitfile, parser)
+    batches = parser.iter_record_batches(fitfile, 100)
+    with pytest.raises(CacheSchemaError):
+        save_cached_batches(fitfile, key, batches)
+    assert glob.glob(str(tmp_path / "*.parquet*")) == []
+
+    path = stream_file_to_cache(fitfile, parser, batch_size=100)
+    streamed = pl.read_parquet(path)
+    assert streamed["Power [W]"].null_count() == 0
+    assert streamed.frame_equal(
+        parse_file(fitfile, parser, use_cache=False), null_equal=True
+    )
+
+
+def test_parse_folder_in_pool(tmp_path, monkeypatch) -> None:
+    for i in range(3):
+        write_fit_file(os.path.join(tmp_path, f"{i}.fit"), n_records=100 * (i + 1))
+    sequential = parse_folder(str(tmp_path), parser=ColumnarFitParser(), n_workers=1)
+    monkeypatch.setattr(Namespace, "parse_pool_min_bytes", 0)
+    pooled = parse_folder(
+        str(tmp_path), parser=ColumnarFitParser(), n_workers=2, use_cache=False
+    )
+    assert pooled.height == 600
+    assert pooled.with_columns(pl.col("file").cast(pl.Utf8)).frame_equal(
+        sequential.with_columns(pl.col("file").cast(pl.Utf8)), null_equal=True
+    )
+
+
+def test_dataset_summaries(tmp_path) -> None:
+    for i in range(2):
+        write_fit_file(os.path.join(tmp_path, f"{i}.fit"), n_records=100 * (i + 1))
+    dataset = Dataset(str(tmp_path), parser=ColumnarFitParser())
+    progress = []
+    dataset.refresh(lambda parsed, total: progress.append((parsed, total)))
+    assert progress == [(0, 2), (1, 2), (2, 2)]
+    assert dataset.files["records"].to_list() == [100, 200]
+    assert dataset.df.height == 300
+    # the mapped frame replaces the frames of the files
+    assert dataset.frames == {}
+    os.remove(os.path.join(tmp_path, "0.fit"))
+    dataset.refresh()
+    assert dataset.df.height == 200
+    frame_files = glob.glob(os.path.join(tmp_path, "frame.*.arrow"))
+    assert frame_files == [
+        os.path.join(tmp_path, f"frame.{dataset.handle.fingerprint}.arrow")
+    ]
+    reloaded = Dataset(str(tmp_path), parser=ColumnarFitParser())
+    assert list(reloaded.summaries) == [os.path.join(tmp_path, "1.fit")]
+    reloaded.refresh()
+    assert reloaded.summary.frame_equal(dataset.summary, null_equal=True)
+    assert reloaded.df.with_columns(pl.col("file").cast(pl.Utf8)).frame_equal(
+        dataset.df.with_columns(pl.col("file").cast(pl.Utf8)), null_equal=True
+    )
+    assert dataset.files["duration"].to_list() == [199.0]
+
+
+def test_file_codes_index_file_table(tmp_path) -> None:
+    for i, name in enumerate(["0.fit", "1.fit", "2.fit"]):
+        write_fit_file(os.path.join(tmp_path, name), n_records=10 * (i + 1))
+    with open(os.path.join(tmp_path, "1_broken.fit"), "wb") as f:
+        f.write(b"not a fit file")
+    dataset = Dataset(str(tmp_path), parser=ColumnarFitParser())
+    dataset.refresh()
+    assert dataset.failed == {os.path.join(tmp_path, "1_broken.fit")}
+    files = dataset.files
+    assert files["file"].to_list() == ["0.fit", "1.fit", "2.fit"]
+    codes = dataset.df["file"].to_physical()
+    assert codes.to_list() == [0] * 10 + [1] * 20 + [2] * 30
+    assert (files["file"].take(codes) == dataset.df["file"].cast(pl.Utf8)).all()
+    assert [(codes == i).sum() for i in range(3)] == files["records"].to_list()
+
+
+def test_dataset_removes_only_older_frames(tmp_path, monkeypatch) -> None:
+    write_fit_file(os.path.join(tmp_path, "0.fit"), n_records=100)
+    dataset = Dataset(str(tmp_path), parser=ColumnarFitParser())
+    dataset.refresh()
+    older, newer = str(tmp_path / "frame.older.arrow"), str(
+        tmp_path / "frame.newer.arrow"
+    )
+    for path, age in [(older, 3600), (newer, -3600)]:
+        open(path, "wb").close()
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def removed_by_another_process(path: str) -> None:
+        raise FileNotFoundError(path)
+
+    # the frame is mapped even if cleaning up fails
+    with monkeypatch.context() as m:
+        m.setattr(os, "remove", removed_by_another_process)
+        assert dataset.df.height == 100
+        assert dataset.frames == {}
+
+    write_fit_file(os.path.join(tmp_path, "1.fit"), n_records=100)
+    dataset.refresh()
+    assert dataset.df.height == 200
+    assert sorted(glob.glob(str(tmp_path / "frame.*.arrow"))) == sorted(
+        [newer, str(tmp_path / f"frame.{dataset.handle.fingerprint}.arrow")]
+    )
+
+
+def test_spatial_index_covers_points_in_view(tmp_path) -> None:
+    for i in range(2):
+        write_fit_file(os.path.join(tmp_path, f"{i}.fit"), n_records=2_000)
+    df = parse_folder(str(tmp_path), parser=ColumnarFitParser())
+    index = SpatialIndex.build(df, chunk_size=100)
+    lat, lon = df["Latitude [°]"].to_numpy(), df["Longitude [°]"].to_numpy()
+    assert index.bounds() == (lat.min(), lat.max(), lon.min(), lon.max())
+    view = (48.005, 48.02, 10.98, 11.0)
+    inside = (lat >= 48.005) & (lat <= 48.02) & (lon >= 10.98) & (lon <= 11.0)
+    assert set(np.flatnonzero(inside)) <= set(index.rows(view))
+    assert len(index.rows((0, 1, 0, 1))) == 0
+
+
+def test_align_files_interpolates_onto_grid() -> None:
+    t = np.array([0, 1, 3, 4, 30, 31], dtype=np.int64)
+    df = pl.DataFrame(
+        {
+            "file": ["a"] * 4 + ["b"] * 2,
+            "Elapsed time [s]": t,
+            "Power [W]": pl.Series([100, 110, 130, 140, 10, 20], dtype=pl.Int16),
+        }
+    )
+    aligned = align_files(df.lazy(), resolution=0.5, max_gap=1.5).collect()
+    assert aligned.schema == {**df.schema, "Elapsed time [s]": pl.Float64}
+    a = aligned.filter(pl.col("file") == "a")
+    # the grid points between 1 and 3 are in a gap
+    assert a["Elapsed time [s]"].to_list() == [0, 0.5, 1, 3, 3.5, 4]
+    assert a["Power [W]"].to_list() == [100, 105, 110, 130, 135, 140]
+    b = aligned.filter(pl.col("file") == "b")
+    assert b["Elapsed time [s]"].to_list() == [30, 30.5, 31]
+    previous = align_files(df.lazy(), resolution=0.5, method="previous").collect()
+    assert previous.filter(pl.col("Elapsed time [s]") == 2)["Power [W]"][0] == 110
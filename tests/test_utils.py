@@ -0,0 +1,220 @@
+"""Tests for `wahoosnowmaker.utils`."""
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from wahoosnowmaker.app.ingest import IngestProgress, IngestQueue
+from wahoosnowmaker.app.memory_cache import MemoryCache
+from wahoosnowmaker.parser import cache
+from wahoosnowmaker.parser.dataset import Dataset
+from wahoosnowmaker.parser.fitparser import ColumnarFitParser
+from wahoosnowmaker.parser.parse_folder import parse_file
+from wahoosnowmaker.utils.blob_store import (
+    blob_file,
+    parsed_folder,
+    prune_blobs,
+    store_blob,
+)
+from wahoosnowmaker.utils.catalog import (
+    STATUS_FAILED,
+    STATUS_NOT_PARSED,
+    STATUS_PARSED,
+    STATUS_PARSING,
+    catalog_file,
+    delete_dataset,
+    list_datasets,
+    load_catalog,
+    rename_dataset,
+    set_status,
+    update_dataset,
+)
+from wahoosnowmaker.utils.synthetic_fit import write_fit_file
+
+
+def test_catalog_tracks_datasets(tmp_path) -> None:
+    data = str(tmp_path)
+    for i in range(3):
+        os.makedirs(os.path.join(data, f"dataset{i}"))
+        with open(os.path.join(data, f"dataset{i}", "a.fit"), "wb") as f:
+            f.write(b"x" * (i + 1))
+    os.makedirs(os.path.join(data, "empty"))
+    # a missing catalog is rebuilt from the folders
+    assert len(load_catalog(data)) == 4
+    datasets, page, n_pages = list_datasets(data, page=5, page_size=2)
+    assert (len(datasets), page, n_pages) == (1, 1, 2)
+
+    folder = os.path.join(data, "dataset0")
+    with open(os.path.join(folder, "b.fit"), "wb") as f:
+        f.write(b"yy")
+    entry = update_dataset(folder + "/", data)
+    assert entry["files"] == ["a.fit", "b.fit"] and entry["size"] == 3
+    assert entry["status"] == STATUS_NOT_PARSED
+    set_status(folder, STATUS_PARSED, data)
+    rename_dataset(folder, "Morning ride", data)
+    delete_dataset(os.path.join(data, "dataset1"), data)
+
+    # the catalog is read from disk, not from the folders
+    os.remove(os.path.join(folder, "a.fit"))
+    catalog = load_catalog(data)
+    assert sorted(catalog) == sorted(
+        os.path.join(data, name) for name in ["dataset0", "dataset2", "empty"]
+    )
+    assert catalog[folder]["name"] == "Morning ride"
+    assert catalog[folder]["status"] == STATUS_PARSED
+    assert catalog[folder]["files"] == ["a.fit", "b.fit"]
+    assert not os.path.exists(catalog_file(data) + ".tmp")
+
+
+def test_catalog_keeps_creation_time(tmp_path) -> None:
+    data = str(tmp_path)
+    folder = os.path.join(data, "2023-05-01T08:30:00.123456")
+    os.makedirs(folder)
+    assert update_dataset(folder, data)["created"] == "2023-05-01T08:30:00.123456"
+    other = os.path.join(data, "dataset")
+    os.makedirs(other)
+    created = update_dataset(other, data)["created"]
+    time.sleep(0.01)
+    with open(os.path.join(other, "a.fit"), "wb") as f:
+        f.write(b"x")
+    assert update_dataset(other, data)["created"] == created
+
+
+def test_blob_store_shares_uploads_and_parsed_results(tmp_path) -> None:
+    blobs = str(tmp_path / "blobs")
+    write_fit_file(str(tmp_path / "upload.fit"), n_records=100)
+    folders = [tmp_path / "first", tmp_path / "second"]
+    for folder in folders:
+        os.makedirs(folder)
+        with open(tmp_path / "upload.fit", "rb") as f:
+            digest = store_blob(f, str(folder / "a.fit"), blobs, chunk_size=1000)
+    assert os.listdir(os.path.join(blobs, "fit")) == [f"{digest}.fit"]
+    assert os.stat(blob_file(digest, blobs)).st_nlink == 3
+
+    parser = ColumnarFitParser()
+    key = cache.cache_key(str(folders[0] / "a.fit"), parser)
+    shared = parsed_folder(blobs)
+    parsed = parse_file(str(folders[0] / "a.fit"), parser, shared_folder=shared)
+    # the second upload reads the sidecar of the first one
+    assert os.path.exists(os.path.join(shared, f"{key}.parquet"))
+    assert cache.load_cached(str(folders[1] / "a.fit"), key) is None
+    reused = cache.load_cached(str(folders[1] / "a.fit"), key, shared_folder=shared)
+    assert reused is not None and reused.frame_equal(parsed, null_equal=True)
+
+    for folder in folders:
+        shutil.rmtree(folder)
+    # an upload that is being stored, and one left behind an hour ago
+    uploading, _ = os.path.splitext(blob_file("uploading", blobs))
+    stale, _ = os.path.splitext(blob_file("stale", blobs))
+    for path in [uploading + ".tmp", stale + ".tmp"]:
+        with open(path, "wb") as f:
+            f.write(b"x")
+    os.utime(stale + ".tmp", (time.time() - 7200, time.time() - 7200))
+    assert prune_blobs(blobs) == 3
+    assert os.listdir(os.path.join(blobs, "fit")) == ["uploading.tmp"]
+
+
+def test_new_blob_is_linked_before_it_is_stored(tmp_path, monkeypatch) -> None:
+    blobs = str(tmp_path / "blobs")
+    replace = os.replace
+
+    def replace_and_prune(source: str, destination: str) -> None:
+        replace(source, destination)
+        # another session deletes a dataset right after the upload is stored
+        assert prune_blobs(blobs) == 0
+
+    monkeypatch.setattr(os, "replace", replace_and_prune)
+    write_fit_file(str(tmp_path / "upload.fit"), n_records=10)
+    with open(tmp_path / "upload.fit", "rb") as f:
+        digest = store_blob(f, str(tmp_path / "a.fit"), blobs)
+    assert os.stat(blob_file(digest, blobs)).st_nlink == 2
+    assert os.listdir(os.path.join(blobs, "fit")) == [f"{digest}.fit"]
+
+
+def test_memory_cache_evicts_least_recently_used() -> None:
+    memory_cache = MemoryCache(budget=2500)
+    for name in ["a", "b"]:
+        memory_cache.register(name)
+    memory_cache.put("a", 1, np.zeros(125))
+    memory_cache.put("a", 2, np.zeros(125))
+    assert memory_cache.get("a", 1) is not None
+    memory_cache.put("b", 1, np.zeros(125))
+    stats = memory_cache.stats()
+    assert stats["a"].evictions == 1 and stats["a"].entries == 1
+    assert memory_cache.get("a", 2) is not memory_cache.get("a", 1)
+    assert memory_cache.stats()["a"].misses == 1
+    assert memory_cache.size == 2000
+    assert memory_cache.evict("b") == 1
+    assert memory_cache.stats()["b"].size == 0 and memory_cache.size == 1000
+
+
+class _GatedDataset(Dataset):
+    """Dataset whose refresh waits for its gate, then fails with `error`."""
+
+    def __init__(self, folder: str, error: Exception | None = None):
+        super().__init__(folder, parser=ColumnarFitParser())
+        self.gate = threading.Event()
+        self.error = error
+        self.refreshes = 0
+
+    def refresh(self, progress=None) -> bool:
+        self.refreshes += 1
+        self.gate.wait(10)
+        if self.error is not None:
+            raise self.error
+        return super().refresh(progress)
+
+
+def _uploaded_folder(tmp_path, monkeypatch) -> str:
+    monkeypatch.chdir(tmp_path)
+    folder = os.path.join("data", "upload")
+    os.makedirs(folder)
+    for i in range(2):
+        write_fit_file(os.path.join(folder, f"{i}.fit"), n_records=100)
+    update_dataset(folder)
+    return folder
+
+
+def _finished(ingest: IngestQueue, folder: str) -> IngestProgress:
+    for _ in range(1000):
+        if (progress := ingest.progress(folder)).finished:
+            return progress
+        time.sleep(0.01)
+    raise TimeoutError(folder)
+
+
+def test_ingest_queue_parses_each_dataset_once(tmp_path, monkeypatch) -> None:
+    folder = _uploaded_folder(tmp_path, monkeypatch)
+    ingest = IngestQueue(n_threads=1)
+    dataset = _GatedDataset(folder)
+    assert ingest.progress(folder) is None
+    ingest.submit(dataset)
+    # e.g. a rerun of Home while the dataset is still parsed
+    ingest.submit(dataset)
+    assert ingest.progress(folder) == IngestProgress(folder)
+    assert load_catalog()[folder]["status"] == STATUS_PARSING
+    dataset.gate.set()
+    assert _finished(ingest, folder) == IngestProgress(folder, 2, 2, True)
+    assert dataset.refreshes == 1
+    assert load_catalog()[folder]["status"] == STATUS_PARSED
+    # a finished dataset is parsed again, e.g. after another upload
+    ingest.submit(dataset)
+    assert _finished(ingest, folder) == IngestProgress(folder, 0, 0, True)
+    assert dataset.refreshes == 2
+
+
+def test_ingest_queue_records_failures(tmp_path, monkeypatch) -> None:
+    folder = _uploaded_folder(tmp_path, monkeypatch)
+    ingest = IngestQueue(n_threads=1)
+    dataset = _GatedDataset(folder, OSError("disk full"))
+    dataset.gate.set()
+    ingest.submit(dataset)
+    assert _finished(ingest, folder).error == "disk full"
+    assert load_catalog()[folder]["status"] == STATUS_FAILED
+    # the worker is still alive
+    dataset.error = None
+    ingest.submit(dataset)
+    assert _finished(ingest, folder).error is None
+    assert load_catalog()[folder]["status"] == STATUS_PARSED
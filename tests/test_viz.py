@@ -0,0 +1,92 @@
+"""Tests for `wahoosnowmaker.app.viz`."""
+import numpy as np
+import polars as pl
+
+from wahoosnowmaker.app.viz.chartsplotly import build_chart_figure
+from wahoosnowmaker.app.viz.density import bin_2d
+from wahoosnowmaker.app.viz.downsampling import lttb_indices, min_max_indices
+from wahoosnowmaker.app.viz.track_simplification import (
+    track_significance,
+    zoom_tolerance,
+)
+from wahoosnowmaker.namespace import DefaultNamespace
+
+
+def test_downsampling_keeps_shape() -> None:
+    x = np.arange(10_000, dtype=np.float64)
+    y = np.sin(x / 500)
+    y[1234] = 10
+    for kept in [lttb_indices(x, y, 500), min_max_indices(y, 500)]:
+        assert len(kept) <= 500
+        assert kept[0] == 0 and kept[-1] == len(x) - 1
+        assert np.all(np.diff(kept) > 0)
+        assert 1234 in kept
+    assert len(lttb_indices(x[:100], y[:100], 500)) == 100
+
+
+def test_track_levels_are_nested() -> None:
+    t = np.arange(5_000, dtype=np.float64)
+    lat, lon = 48 + 0.01 * np.sin(t / 300), 11 + 0.01 * np.cos(t / 500)
+    lat[2000:2010] = np.nan
+    significance = track_significance(lat, lon)
+    previous = None
+    for zoom in [8, 12, 16, 20]:
+        kept = set(np.flatnonzero(significance >= zoom_tolerance(zoom)))
+        assert {0, 1999, 2010, 4999} <= kept
+        assert previous is None or previous < kept
+        previous = kept
+
+
+def test_bin_2d_counts_every_point() -> None:
+    rng = np.random.default_rng(0)
+    df = pl.DataFrame(
+        {
+            "x": rng.normal(size=10_000),
+            "y": rng.normal(size=10_000),
+            "file": rng.choice(["a", "b"], 10_000),
+        }
+    ).with_columns(pl.col("x").alias("speed"))
+    density = bin_2d(df, "x", "y", "file", 20)
+    assert density["count"].sum() == 10_000
+    assert density["x"].n_unique() <= 20 and density["y"].n_unique() <= 20
+    counts, _, _ = np.histogram2d(df["x"], df["y"], bins=20)
+    assert sorted(
+        density.groupby(["x", "y"]).agg(pl.col("count").sum())["count"]
+    ) == sorted(counts[counts > 0])
+    by_speed = bin_2d(df, "x", "y", "speed", 20)
+    assert by_speed.height == np.count_nonzero(counts)
+    assert by_speed["color"].is_between(by_speed["x"] - 0.5, by_speed["x"] + 0.5).all()
+
+
+def test_chart_has_one_trace_per_file_and_field() -> None:
+    n_long = DefaultNamespace.chart_webgl_points + 500
+    speed = np.ones(n_long + 100)
+    speed[[10, n_long + 10]] = np.nan
+    power = pl.Series(np.arange(n_long + 100), dtype=pl.Int64)
+    power[20] = None
+    df = pl.DataFrame(
+        {
+            DefaultNamespace.default_color_by: ["long"] * n_long + ["short"] * 100,
+            DefaultNamespace.column_elapsed_time: np.r_[
+                np.arange(n_long), np.arange(100)
+            ].astype(np.float64),
+            "speed": speed,
+            "power": power,
+        }
+    ).with_columns(pl.col(DefaultNamespace.default_color_by).cast(pl.Categorical))
+    fields = ["speed", "power"]
+
+    fig = build_chart_figure(df, fields)
+    assert len(fig.data) == len(fields) * 2
+    assert [trace.name for trace in fig.data] == ["long", "short"] * 2
+    assert [trace.type for trace in fig.data] == ["scattergl", "scatter"] * 2
+    assert [trace.showlegend for trace in fig.data] == [True, True, False, False]
+    assert [len(trace.x) for trace in fig.data] == [n_long - 1, 99, n_long - 1, 100]
+    for trace in fig.data:
+        assert not np.isnan(np.asarray(trace.y, dtype=np.float64)).any()
+
+    fig = build_chart_figure(df, fields, time_window=(50.0, 80.0))
+    assert [trace.type for trace in fig.data] == ["scatter"] * 4
+    for trace in fig.data:
+        assert len(trace.x) == 31
+        assert min(trace.x) == 50 and max(trace.x) == 80
@@ -1,17 +1,146 @@
 """Entry point to our Streamlit app."""
 import glob
 import os
-import shutil
-from pathlib import Path
 
 import streamlit as st
 
-from wahoosnowmaker import logger
+from wahoosnowmaker.app.datastore import get_dataset
+from wahoosnowmaker.app.ingest import get_ingest_queue
 from wahoosnowmaker.app.markdown import centered_markdown_title
 from wahoosnowmaker.app.security import check_password
 from wahoosnowmaker.namespace import DefaultNamespace
+from wahoosnowmaker.parser.cache import remove_cached
+from wahoosnowmaker.utils.blob_store import prune_blobs, store_blob
+from wahoosnowmaker.utils.catalog import (
+    delete_dataset,
+    list_datasets,
+    update_dataset,
+)
 from wahoosnowmaker.utils.create_dataset_folder import create_dataset_folder
-from wahoosnowmaker.utils.saveload import load_name
+
+
+def store_uploads(uploaded_files: list) -> str:
+    """Links the uploaded files into the dataset of this upload, returns its folder.
+
+    The uploader keeps its files across reruns, the dataset is only changed
+    when they change.
+    """
+    names = sorted(uploaded_file.name for uploaded_file in uploaded_files)
+    folder = st.session_state.get("upload_folder")
+    if folder is not None and os.path.isdir(folder):
+        if st.session_state.get("upload_names") == names:
+            return folder
+    else:
+        # create new location to store data
+        folder = create_dataset_folder()
+
+    # upload files, each content is stored once
+    for uploaded_file in uploaded_files:
+        path = os.path.join(folder, uploaded_file.name)
+        if not os.path.exists(path):
+            store_blob(uploaded_file, path)
+    # but also delete files
+    for file in glob.glob(folder + "*.fit"):
+        if os.path.basename(file) not in names:
+            os.remove(file)
+            remove_cached(file)
+    update_dataset(folder)
+    # parse while the user is still on this page
+    get_ingest_queue().submit(get_dataset(os.path.normpath(folder)))
+    st.session_state["upload_folder"] = folder
+    st.session_state["upload_names"] = names
+    # redirect to analysis view
+    # webbrowser.open(f"{DefaultNamespace.domain}/Analysis?folder={folder}")
+    return folder
+
+
+def set_catalog_page(page: int) -> None:
+    st.session_state["catalog_page"] = page
+
+
+def toggle_catalog_files(folder: str) -> None:
+    expanded = st.session_state.setdefault("catalog_expanded", set())
+    expanded ^= {folder}
+
+
+def show_files(folder: str, files: list[str]) -> None:
+    """Download buttons for the files of a dataset, only read once it is expanded."""
+    missing = False
+    for file in files:
+        path = os.path.join(folder, file)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            missing = True
+            continue
+        centerleft, centerright = st.columns((4, 1))
+        with centerleft:
+            st.text(path)
+        with centerright:
+            st.download_button(
+                label="Download", data=data, file_name=file, key=f"Download {path}"
+            )
+    if missing:
+        # e.g. deleted outside of the app, the entry is rescanned
+        update_dataset(folder)
+
+
+def show_catalog():
+    st.markdown(
+        centered_markdown_title("Inspect old dataset", heading_level=2),
+        unsafe_allow_html=True,
+    )
+    # the catalog is listed instead of the folders, one page at a time
+    datasets, page, n_pages = list_datasets(
+        page=st.session_state.get("catalog_page", 0)
+    )
+    for dataset in datasets:
+        folder, files = dataset["folder"], dataset["files"]
+        n = len(files)
+        url = f"""{DefaultNamespace.domain}/Analysis?folder={folder}"""
+
+        left, right = st.columns((4, 1))
+        with left:
+            st.write(f"""#### [{dataset["name"]}]({url})""")
+            st.caption(
+                f"""{dataset["created"][:16].replace("T", " ")}, """
+                f"""{dataset["size"] / 2**20:.1f} MB, {dataset["status"]}"""
+            )
+        with right:
+            button_delete = st.button("Delete", key=f"Delete {folder}")
+            if button_delete:
+                delete_dataset(folder)
+                prune_blobs()
+                st.experimental_rerun()
+        expanded = folder in st.session_state.get("catalog_expanded", set())
+        st.button(
+            f"""{"Hide" if expanded else "See"} {n} .fit file{"" if n==1 else "s"}""",
+            key=f"Files {folder}",
+            on_click=toggle_catalog_files,
+            args=(folder,),
+        )
+        if expanded:
+            show_files(folder, files)
+
+    if n_pages > 1:
+        left, center, right = st.columns((1, 4, 1))
+        with left:
+            st.button(
+                "Previous",
+                disabled=page == 0,
+                on_click=set_catalog_page,
+                args=(page - 1,),
+            )
+        with center:
+            st.write(f"Page {page + 1} of {n_pages}")
+        with right:
+            st.button(
+                "Next",
+                disabled=page >= n_pages - 1,
+                on_click=set_catalog_page,
+                args=(page + 1,),
+            )
 
 
 def app():
@@ -26,60 +155,10 @@ def app():
         unsafe_allow_html=True,
     )
     uploaded_files = st.file_uploader(" ", type=".fit", accept_multiple_files=True)
-    if uploaded_files is not None:
-        # create new location to store data
-        folder = create_dataset_folder()
+    if uploaded_files:
+        store_uploads(uploaded_files)
 
-        # upload files
-        for uploaded_file in uploaded_files:
-            path = Path(folder, uploaded_file.name)
-            if not os.path.exists(path):
-                with open(path, mode="wb") as w:
-                    w.write(uploaded_file.getvalue())
-        # but also delete files
-        for file in glob.glob(folder + "*.fit"):
-            if os.path.basename(file) not in [f.name for f in uploaded_files]:
-                os.remove(file)
-        # redirect to analysis view
-        if len(uploaded_files) > 0:
-            url = f"""{DefaultNamespace.domain}/Analysis?folder={folder}"""
-            # webbrowser.open(url)
-
-    # Inspect existing data
-    st.markdown(
-        centered_markdown_title("Inspect old dataset", heading_level=2),
-        unsafe_allow_html=True,
-    )
-    existing_folders = glob.glob("data/*")
-    existing_folders.sort(reverse=True)
-    for _i, folder in enumerate(existing_folders):
-        files = glob.glob(folder + "/*.fit")
-        if (n := len(files)) > 0:
-            url = f"""{DefaultNamespace.domain}/Analysis?folder={folder}"""
-
-            left, right = st.columns((4, 1))
-            with left:
-                name = load_name(folder)
-                st.write(f"""#### [{name}]({url})""")
-            with right:
-                button_delete = st.button("Delete", key=f"Delete {_i}")
-                if button_delete:
-                    shutil.rmtree(folder)
-                    st.experimental_rerun()
-            with st.expander(f"""See {n} .fit file{"" if n==1 else "s"}"""):
-                for file in files:
-                    centerleft, centerright = st.columns((4, 1))
-                    with centerleft:
-                        st.text(file)
-                    with centerright:
-                        with open(file, "rb") as f:
-                            st.download_button(label="Download", data=f, file_name=file)
-
-        else:
-            try:
-                shutil.rmtree(folder)
-            except Exception as e:
-                logger.warning(e)
+    show_catalog()
 
 
 if __name__ == "__main__":
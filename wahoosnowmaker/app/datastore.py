@@ -0,0 +1,65 @@
+"""Datasets shared by all sessions, resolved from their handles.
+
+Cached functions take a `DatasetHandle` instead of a dataframe, so that
+streamlit hashes a folder and a fingerprint on every rerun instead of every
+row of the frame.
+"""
+import polars as pl
+import streamlit as st
+
+from wahoosnowmaker.app.memory_cache import memory_cached
+from wahoosnowmaker.namespace import DefaultNamespace
+from wahoosnowmaker.parser.dataset import Dataset, DatasetHandle
+from wahoosnowmaker.parser.pipes import align_files
+from wahoosnowmaker.parser.spatial_index import SpatialIndex
+from wahoosnowmaker.utils.blob_store import parsed_folder
+from wahoosnowmaker.utils.catalog import STATUS_PARSED, set_status
+
+
+@st.cache_resource
+def get_dataset(dataset_folder: str) -> Dataset:
+    return Dataset(
+        dataset_folder,
+        n_workers=DefaultNamespace.parse_folder_workers,
+        shared_folder=parsed_folder(),
+    )
+
+
+def refresh_dataset(dataset_folder: str) -> DatasetHandle:
+    """Parses new or changed files, returns the handle of the current content."""
+    dataset = get_dataset(dataset_folder)
+    dataset.refresh()
+    record_status(dataset)
+    return dataset.handle
+
+
+def record_status(dataset: Dataset) -> None:
+    """Stores in the catalog whether all files of a dataset could be parsed."""
+    if n := len(dataset.failed):
+        set_status(dataset.folder, f"""{n} file{"" if n==1 else "s"} failed""")
+    else:
+        set_status(dataset.folder, STATUS_PARSED)
+
+
+def get_frame(handle: DatasetHandle) -> pl.DataFrame:
+    """Polars frame of a dataset, shared by all sessions without copies."""
+    return get_dataset(handle.folder).df
+
+
+def get_spatial_index(handle: DatasetHandle) -> SpatialIndex:
+    """Bounding boxes of the tracks of a dataset, built once per version."""
+    return get_dataset(handle.folder).spatial_index
+
+
+@memory_cached
+def get_aligned_frame(
+    handle: DatasetHandle, on: str, resolution: float, method: str = "linear"
+) -> pl.DataFrame:
+    """Files of a dataset resampled onto a common grid of `on`, see `align_files`."""
+    return align_files(
+        get_frame(handle).lazy(),
+        resolution,
+        on,
+        method,
+        max_gap=DefaultNamespace.alignment_max_gap.get(on),
+    ).collect()
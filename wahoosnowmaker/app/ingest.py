@@ -0,0 +1,84 @@
+"""Parsing of uploaded datasets in the background.
+
+Home submits a dataset as soon as its files are stored. Worker threads of
+the app process refresh it, so that its files are parsed before the
+Analysis page is opened. Parsing itself runs in the dataset's process pool,
+the threads only wait for it. Analysis shows the progress of a dataset that
+is still being parsed and then uses the parsed frames of the shared dataset.
+"""
+import queue
+import threading
+from dataclasses import dataclass, replace
+from functools import partial
+
+import streamlit as st
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.app.datastore import record_status
+from wahoosnowmaker.namespace import DefaultNamespace
+from wahoosnowmaker.parser.dataset import Dataset
+from wahoosnowmaker.utils.catalog import (
+    STATUS_FAILED,
+    STATUS_PARSING,
+    set_status,
+)
+
+
+@dataclass
+class IngestProgress:
+    folder: str
+    parsed: int = 0
+    total: int = 0
+    finished: bool = False
+    error: str | None = None
+
+
+class IngestQueue:
+    def __init__(self, n_threads: int = DefaultNamespace.ingest_threads):
+        self._queue: queue.Queue[Dataset] = queue.Queue()
+        self._progress: dict[str, IngestProgress] = {}
+        self._lock = threading.Lock()
+        for _ in range(n_threads):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, dataset: Dataset) -> None:
+        """Queues a dataset for parsing, unless it is queued already."""
+        with self._lock:
+            progress = self._progress.get(dataset.folder)
+            if progress is not None and not progress.finished:
+                return
+            self._progress[dataset.folder] = IngestProgress(dataset.folder)
+        set_status(dataset.folder, STATUS_PARSING)
+        self._queue.put(dataset)
+
+    def progress(self, folder: str) -> IngestProgress | None:
+        """Copy of the progress of a submitted dataset."""
+        with self._lock:
+            progress = self._progress.get(folder)
+            return None if progress is None else replace(progress)
+
+    def _update(self, folder: str, **changes) -> None:
+        with self._lock:
+            self._progress[folder] = replace(self._progress[folder], **changes)
+
+    def _report(self, folder: str, parsed: int, total: int) -> None:
+        self._update(folder, parsed=parsed, total=total)
+
+    def _work(self) -> None:
+        while True:
+            dataset = self._queue.get()
+            try:
+                dataset.refresh(partial(self._report, dataset.folder))
+                record_status(dataset)
+                self._update(dataset.folder, finished=True)
+            except Exception as e:
+                logger.error(f"Could not parse {dataset.folder}: {e}")
+                set_status(dataset.folder, STATUS_FAILED)
+                self._update(dataset.folder, finished=True, error=str(e))
+            finally:
+                self._queue.task_done()
+
+
+@st.cache_resource
+def get_ingest_queue() -> IngestQueue:
+    return IngestQueue()
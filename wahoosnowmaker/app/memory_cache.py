@@ -0,0 +1,160 @@
+"""Memory-budgeted cache of the results of expensive functions of the app.
+
+`st.cache_data` keeps every result until the process ends. Functions
+decorated with `memory_cached` share one budget of
+`Namespace.cache_memory_budget` bytes instead, and the least recently used
+results of all of them are evicted when it is exceeded. Results are returned
+without copying, so callers must not modify them.
+
+Hits, misses and evictions are counted per function and shown on the Debug
+page, which can also evict results.
+"""
+import functools
+import inspect
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, replace
+from typing import Any, TypeVar
+
+import numpy as np
+import polars as pl
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.namespace import Namespace
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory of a result in bytes."""
+    if isinstance(value, pl.DataFrame):
+        return int(value.estimated_size())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    try:
+        # e.g. figures, whose arrays dominate their pickled size
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, list | tuple):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class MemoryCache:
+    def __init__(self, budget: int = Namespace.cache_memory_budget):
+        self.budget = budget
+        self.size = 0
+        # (cache, key) -> (result, size), least recently used first
+        self._entries: OrderedDict[
+            tuple[str, Hashable], tuple[Any, int]
+        ] = OrderedDict()
+        self._stats: dict[str, CacheStats] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str) -> None:
+        """Adds a cache, so that it is listed before its first call."""
+        with self._lock:
+            self._stats.setdefault(name, CacheStats())
+
+    def get(self, name: str, key: Hashable) -> Any:
+        """Cached result, or `_MISSING`, and counts the hit or miss."""
+        with self._lock:
+            entry = self._entries.get((name, key))
+            if entry is None:
+                self._stats[name].misses += 1
+                return _MISSING
+            self._entries.move_to_end((name, key))
+            self._stats[name].hits += 1
+            return entry[0]
+
+    def put(self, name: str, key: Hashable, result: Any) -> None:
+        """Stores a result and evicts others until the budget is met."""
+        size = estimate_size(result)
+        if size > self.budget:
+            logger.warning(f"Result of {name} exceeds the cache budget.")
+            return
+        with self._lock:
+            if (name, key) in self._entries:
+                return
+            self._entries[(name, key)] = (result, size)
+            self._stats[name].entries += 1
+            self._stats[name].size += size
+            self.size += size
+            self._evict(lambda entry_name: True, self.budget)
+
+    def _evict(self, selected: Callable[[str], bool], target: int) -> int:
+        evicted = 0
+        for name, key in list(self._entries):
+            if self.size <= target:
+                break
+            if not selected(name):
+                continue
+            _, size = self._entries.pop((name, key))
+            stats = self._stats[name]
+            stats.entries -= 1
+            stats.size -= size
+            stats.evictions += 1
+            self.size -= size
+            evicted += 1
+        return evicted
+
+    def evict(self, name: str | None = None, target: int = 0) -> int:
+        """Evicts results, of one cache or all, until at most `target` bytes remain.
+
+        Returns the number of evicted results.
+        """
+        with self._lock:
+            return self._evict(lambda entry_name: name in (None, entry_name), target)
+
+    def stats(self) -> dict[str, CacheStats]:
+        """Copy of the counters of every cache."""
+        with self._lock:
+            return {name: replace(stats) for name, stats in self._stats.items()}
+
+
+memory_cache = MemoryCache()
+
+
+def memory_cached(function: Callable[..., T]) -> Callable[..., T]:
+    """Caches the results of `function` by its arguments in `memory_cache`.
+
+    The arguments must be hashable, lists and dicts are converted to tuples.
+    """
+    name = function.__qualname__
+    signature = inspect.signature(function)
+    memory_cache.register(name)
+
+    @functools.wraps(function)
+    def cached(*args, **kwargs) -> T:
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = _freeze(arguments.arguments)
+        result = memory_cache.get(name, key)
+        if result is _MISSING:
+            result = function(*args, **kwargs)
+            memory_cache.put(name, key, result)
+        return result
+
+    return cached
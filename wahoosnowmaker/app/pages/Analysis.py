@@ -1,31 +1,30 @@
 import glob as glob
+import os
+import time
 
-import numpy as np
-import pandas as pd
 import streamlit as st
 
+from wahoosnowmaker.app.datastore import get_dataset, get_frame, refresh_dataset
+from wahoosnowmaker.app.ingest import get_ingest_queue
 from wahoosnowmaker.app.markdown import centered_markdown_title
 from wahoosnowmaker.app.viz.chartsplotly import (
     show_chart,
     show_map,
     show_scatter,
 )
+from wahoosnowmaker.app.viz.frames import to_arrow
 from wahoosnowmaker.namespace import DefaultNamespace
-from wahoosnowmaker.parser.parse_folder import parse_folder
+from wahoosnowmaker.parser.dataset import DatasetHandle
+from wahoosnowmaker.utils.catalog import rename_dataset
 from wahoosnowmaker.utils.saveload import (
     load_name,
     load_notes,
-    save_name,
     save_notes,
 )
 
 
-@st.cache_data  # should receive the files, not the folder
-def cached_parse_folder(dataset_folder):
-    return parse_folder(dataset_folder)
-
-
-def show_analysis(df: pd.DataFrame, folder: str):
+def show_analysis(handle: DatasetHandle, folder: str):
+    df = get_frame(handle)
     st.write(
         centered_markdown_title(DefaultNamespace.app_name, DefaultNamespace.domain),
         unsafe_allow_html=True,
@@ -39,9 +38,7 @@ def show_analysis(df: pd.DataFrame, folder: str):
         ["Options", "Data", "Rename", "Download", "Notes", "Statistics"]
     )
     with tab1:
-        default = int(
-            np.argwhere(df.columns == DefaultNamespace.default_color_by)[0][0]
-        )
+        default = df.columns.index(DefaultNamespace.default_color_by)
         color_by = st.selectbox("Color map trace", df.columns, default)
         if color_by is None:
             color_by = DefaultNamespace.default_color_by
@@ -63,11 +60,53 @@ def show_analysis(df: pd.DataFrame, folder: str):
         )
         chart_options = st.multiselect("Charts", options, default_options)
 
+        downsampling = st.selectbox(
+            "Chart downsampling", DefaultNamespace.chart_downsampling_methods, 0
+        )
+        n_points = st.number_input(
+            "Points per chart trace",
+            min_value=100,
+            value=DefaultNamespace.default_chart_points,
+            step=500,
+        )
+        # zooming into a narrow window re-renders it at full resolution
+        start = float(df[DefaultNamespace.column_elapsed_time].min())
+        end = max(float(df[DefaultNamespace.column_elapsed_time].max()), start + 1)
+        time_window = st.slider(
+            "Chart window [s]", min_value=start, max_value=end, value=(start, end)
+        )
+        # aligned files share a grid and can be compared row by row
+        align_on = st.selectbox(
+            "Align files on",
+            ["none"]
+            + [c for c in DefaultNamespace.alignment_resolution if c in df.columns],
+            0,
+        )
+        resolution = st.number_input(
+            "Alignment resolution",
+            min_value=0.1,
+            value=DefaultNamespace.alignment_resolution.get(align_on, 1.0),
+        )
+        align_method = st.selectbox("Alignment", DefaultNamespace.alignment_methods, 0)
+        if align_on not in ["none", DefaultNamespace.column_elapsed_time]:
+            # the chart window is in seconds
+            time_window = None
+        density_points = st.number_input(
+            "Bin x vs y above [points]",
+            min_value=0,
+            value=DefaultNamespace.scatter_density_points,
+            step=10_000,
+        )
+        density_bins = st.number_input(
+            "Bins per axis", min_value=10, value=DefaultNamespace.scatter_density_bins
+        )
+
     with tab2:
-        st.write(df)
+        st.dataframe(to_arrow(df))
     with tab3:
         dataset_name = st.text_input("Rename session", load_name(folder))
-        save_name(folder, dataset_name)
+        if dataset_name != load_name(folder):
+            rename_dataset(folder, dataset_name)
 
     with tab4:
         files = glob.glob(folder + "/*.fit")
@@ -86,19 +125,36 @@ def show_analysis(df: pd.DataFrame, folder: str):
         save_notes(folder, dataset_notes)
 
     with tab6:
-        for group, dfgroup in df.groupby("file"):
-            st.write(group)
-            st.write(dfgroup.describe())
+        # summaries are computed when the files are parsed
+        dataset = get_dataset(handle.folder)
+        st.dataframe(to_arrow(dataset.files))
+        for file, file_statistics in dataset.summary.groupby(
+            DefaultNamespace.column_file, maintain_order=True
+        ):
+            st.write(file)
+            st.dataframe(to_arrow(file_statistics.drop(DefaultNamespace.column_file)))
 
     if (
         DefaultNamespace.column_longitude in df.columns
         and DefaultNamespace.column_longitude in df
     ):
         show_map(
-            df, color_attribute=color_by, mapbox_style=map_style, color_scale=colorscale
+            handle,
+            color_attribute=color_by,
+            mapbox_style=map_style,
+            color_scale=colorscale,
         )
     if len(chart_options) > 0:
-        show_chart(df, chart_options)
+        show_chart(
+            handle,
+            chart_options,
+            n_points=int(n_points),
+            method=downsampling,
+            time_window=time_window,
+            align_on=None if align_on == "none" else align_on,
+            resolution=float(resolution),
+            align_method=align_method,
+        )
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -106,27 +162,52 @@ def show_analysis(df: pd.DataFrame, folder: str):
     with col2:
         yvalue = st.selectbox("Column for y-axis.", df.columns, key="yscatter")
     with col3:
-        default = int(
-            np.argwhere(df.columns == DefaultNamespace.default_color_by)[0][0]
-        )
+        default = df.columns.index(DefaultNamespace.default_color_by)
         color_by = st.selectbox("Color", df.columns, default, key="color")
         if color_by is None:
             color_by = DefaultNamespace.default_color_by
-    show_scatter(df, xvalue, yvalue, color_by)
+    show_scatter(
+        handle,
+        xvalue,
+        yvalue,
+        color_by,
+        density_points=int(density_points),
+        bins=int(density_bins),
+    )
+
+
+def wait_for_ingest(folder: str) -> None:
+    """Shows the progress of a dataset that is parsed in the background."""
+    ingest_queue = get_ingest_queue()
+    progress = ingest_queue.progress(folder)
+    if progress is None or progress.finished:
+        return
+    bar = st.progress(0.0, text="Parsing files")
+    while not progress.finished:
+        if progress.total > 0:
+            bar.progress(
+                progress.parsed / progress.total,
+                text=f"Parsed {progress.parsed} of {progress.total} files",
+            )
+        time.sleep(DefaultNamespace.ingest_poll_interval)
+        progress = ingest_queue.progress(folder)
+    bar.empty()
 
 
 def app():
     query_parameters = st.experimental_get_query_params()
     if query_parameters is not None:
         if "folder" in query_parameters.keys():
-            folder = query_parameters["folder"][0]
+            # the same folder as submitted for parsing by Home
+            folder = os.path.normpath(query_parameters["folder"][0])
 
             uploaded_files = glob.glob(folder + "/*.fit")
 
             if uploaded_files is not None:
                 if len(uploaded_files) > 0:
-                    df = cached_parse_folder(folder).to_pandas()
-                    show_analysis(df, folder)
+                    wait_for_ingest(folder)
+                    # only parses the files that were added or changed
+                    show_analysis(refresh_dataset(folder), folder)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,12 @@
 import shutil
+from dataclasses import asdict
 
 import psutil
 import streamlit as st
 
+from wahoosnowmaker.app.memory_cache import memory_cache
+from wahoosnowmaker.app.security import check_password
+
 if __name__ == "__main__":
     stat = shutil.disk_usage("/")
     # Print disk usage statistics
@@ -12,3 +16,18 @@ if __name__ == "__main__":
     # you can have the percentage of used RAM
     st.write(f"""RAM usage: {psutil.virtual_memory().percent:.2f}% used""")
     st.write(dict(psutil.virtual_memory()._asdict()))
+
+    st.write(
+        f"""Cache: {memory_cache.size / 2**20:.1f} of """
+        f"""{memory_cache.budget / 2**20:.0f} MB used"""
+    )
+    stats = memory_cache.stats()
+    st.dataframe(
+        [{"cache": name, **asdict(cache_stats)} for name, cache_stats in stats.items()],
+        use_container_width=True,
+    )
+    if check_password():
+        cache = st.selectbox("Cache", ["all", *stats])
+        if st.button("Evict"):
+            evicted = memory_cache.evict(None if cache == "all" else cache)
+            st.write(f"Evicted {evicted} results.")
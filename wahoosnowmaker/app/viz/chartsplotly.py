@@ -1,74 +1,183 @@
-import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import polars as pl
 import streamlit as st
+from plotly.subplots import make_subplots
 
 from wahoosnowmaker import logger
+from wahoosnowmaker.app.datastore import (
+    get_aligned_frame,
+    get_frame,
+    get_spatial_index,
+)
+from wahoosnowmaker.app.memory_cache import memory_cached
+from wahoosnowmaker.app.viz.density import get_density
+from wahoosnowmaker.app.viz.downsampling import downsample_indices
+from wahoosnowmaker.app.viz.frames import row_indices_by, to_plotly
 from wahoosnowmaker.app.viz.map_calculations import (
+    get_center_and_zoom,
     get_center_lat_lon,
     get_zoom_level,
 )
+from wahoosnowmaker.app.viz.track_simplification import (
+    get_track_significance,
+    simplify_tracks,
+)
 from wahoosnowmaker.namespace import DefaultNamespace
+from wahoosnowmaker.parser.dataset import DatasetHandle
 
 
-@st.cache_data
-def show_chart(df: pd.DataFrame, fields_to_plot: list[str]) -> None:
-    logger.info("Creating chart.")
+def build_chart_figure(
+    df: pl.DataFrame,
+    fields_to_plot: list[str],
+    n_points: int = 0,
+    method: str = "none",
+    time_window: tuple[float, float] | None = None,
+    x_column: str = DefaultNamespace.column_elapsed_time,
+) -> go.Figure:
+    """One row per field with one trace per file, built from the wide frame.
 
-    df_long = (
-        pd.melt(
-            df,
-            id_vars=[
-                DefaultNamespace.column_elapsed_time,
-                DefaultNamespace.default_color_by,
-            ],
-            value_name="value",
-            var_name="type",
-        )
-        .dropna()
-        .reset_index()
-        .drop(columns=["index"])
+    Only samples with `x_column` within `time_window` are kept and every trace
+    is downsampled to `n_points`, so a narrow window is shown at full
+    resolution. Traces with many points are rendered with WebGL.
+    """
+    positions = df[x_column].to_numpy()
+    in_window = np.ones(len(df), dtype=bool)
+    if time_window is not None:
+        in_window = (positions >= time_window[0]) & (positions <= time_window[1])
+    files = row_indices_by(df, DefaultNamespace.default_color_by)
+    colors = px.colors.qualitative.Plotly
+
+    fig = make_subplots(
+        rows=len(fields_to_plot), cols=1, shared_xaxes=True, vertical_spacing=0.01
     )
-    df_long = df_long.loc[df_long["type"].isin(fields_to_plot)]
-
-    fig = px.line(
-        df_long,
-        x=DefaultNamespace.column_elapsed_time,
-        y="value",
-        color=DefaultNamespace.default_color_by,
-        facet_row="type",
+    for row, field in enumerate(fields_to_plot, start=1):
+        values = df[field].to_numpy()
+        numeric = df[field].is_numeric()
+        keep = in_window & ~df[field].is_null().to_numpy()
+        if numeric:
+            keep &= ~np.isnan(values)
+        for i, (file, index) in enumerate(files.items()):
+            index = index[keep[index]]
+            x, y = positions[index], values[index]
+            if numeric:
+                kept = downsample_indices(x, y, n_points, method)
+                x, y = x[kept], y[kept]
+            scatter = (
+                go.Scattergl
+                if len(x) > DefaultNamespace.chart_webgl_points
+                else go.Scatter
+            )
+            fig.add_trace(
+                scatter(
+                    x=x,
+                    y=y,
+                    name=str(file),
+                    legendgroup=str(file),
+                    showlegend=row == 1,
+                    mode="lines+markers",
+                    marker={"size": 4},
+                    line={"color": colors[i % len(colors)]},
+                ),
+                row=row,
+                col=1,
+            )
+        fig.update_yaxes(title_text=field, row=row, col=1)
+    fig.update_xaxes(title_text=x_column, row=len(fields_to_plot), col=1)
+    fig.update_layout(
         height=len(fields_to_plot) * 300,
-        facet_row_spacing=0.01,
         width=800,
-        category_orders={"type": fields_to_plot},
+        legend_title_text=DefaultNamespace.default_color_by,
     )
-
-    fig.update_traces(mode="lines+markers")
-    fig.update_traces(marker={"size": 4})
-    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-    for i in range(len(df_long["type"].unique())):
-        annotation = fig.layout.annotations[i].text  # type: ignore
-        fig.layout[  # type: ignore
-            f"""yaxis{"" if i==0 else str(i+1)}"""  # type: ignore
-        ].title.text = annotation  # type: ignore
-        fig.layout.annotations[i].text = ""  # type: ignore
-    # fig.for_each_annotation(lambda a: a.update(font={"size": 20}))
-    # fig.for_each_annotation(lambda a: a.update(textangle=0))
-    fig.update_yaxes(matches=None)
     fig.update_xaxes(showgrid=True)
     fig.update_yaxes(showgrid=True)
+    return fig
+
 
+@memory_cached
+def get_chart_figure(
+    handle: DatasetHandle,
+    fields_to_plot: list[str],
+    n_points: int = DefaultNamespace.default_chart_points,
+    method: str = DefaultNamespace.default_chart_downsampling,
+    time_window: tuple[float, float] | None = None,
+    align_on: str | None = None,
+    resolution: float = 1.0,
+    align_method: str = "linear",
+) -> go.Figure:
+    """Charts of the raw samples, or of the files aligned on `align_on`."""
+    logger.info("Creating chart.")
+
+    if align_on is None:
+        df, x_column = get_frame(handle), DefaultNamespace.column_elapsed_time
+    else:
+        df = get_aligned_frame(handle, align_on, resolution, align_method)
+        x_column = align_on
+    return build_chart_figure(
+        df, fields_to_plot, n_points, method, time_window, x_column
+    )
+
+
+def show_chart(
+    handle: DatasetHandle,
+    fields_to_plot: list[str],
+    n_points: int = DefaultNamespace.default_chart_points,
+    method: str = DefaultNamespace.default_chart_downsampling,
+    time_window: tuple[float, float] | None = None,
+    align_on: str | None = None,
+    resolution: float = 1.0,
+    align_method: str = "linear",
+) -> None:
+    """Shows the charts of `get_chart_figure`."""
+    fig = get_chart_figure(
+        handle,
+        fields_to_plot,
+        n_points,
+        method,
+        time_window,
+        align_on,
+        resolution,
+        align_method,
+    )
     st.plotly_chart(fig, use_container_width=True)
 
 
-@st.cache_data
-def show_map(
-    df: pd.DataFrame,
+def build_map_traces(
+    df: pl.DataFrame,
     color_attribute: str = DefaultNamespace.default_color_by,
-    mapbox_style: str = "carto-positron",
-    color_scale: str = "viridis",
-) -> None:
-    logger.info("Creating map.")
+    significance: np.ndarray | None = None,
+    bounds: tuple[float, float, float, float] | None = None,
+) -> go.Figure:
+    """Map of the tracks of all files, without styling.
+
+    The traces, center and zoom only depend on the data, see `style_map_figure`
+    for the options that can change without rebuilding them. `significance` of
+    the track vertices and the `bounds` of the tracks, e.g. from the dataset's
+    spatial index, are computed if they are not given.
+    """
+    if bounds is None:
+        zoom = get_zoom_level(
+            df[DefaultNamespace.column_latitude],
+            df[DefaultNamespace.column_longitude],
+            fudge=0.1,
+        )
+        center = get_center_lat_lon(df)
+    else:
+        center, zoom = get_center_and_zoom(bounds, fudge=0.1)
+    # only the vertices visible when zooming in a few levels are drawn
+    df = simplify_tracks(
+        df, zoom + DefaultNamespace.map_detail_zoom_levels, significance
+    )
+    df = to_plotly(
+        df,
+        [
+            DefaultNamespace.column_latitude,
+            DefaultNamespace.column_longitude,
+            DefaultNamespace.default_color_by,
+            color_attribute,
+        ],
+    )
 
     if color_attribute != DefaultNamespace.default_color_by:
         fig = px.scatter_mapbox(
@@ -76,7 +185,6 @@ def show_map(
             lon=DefaultNamespace.column_longitude,
             lat=DefaultNamespace.column_latitude,
             color=color_attribute,
-            color_continuous_scale=color_scale,
         )
 
         fig.add_traces(
@@ -103,22 +211,28 @@ def show_map(
             color=DefaultNamespace.default_color_by,
         )
 
-    zoom = get_zoom_level(
-        df[DefaultNamespace.column_latitude],
-        df[DefaultNamespace.column_longitude],
-        fudge=0.1,
-    )
     fig.update_layout(
-        margin={"l": 0, "t": 0, "b": 0, "r": 0},
-        height=800,
-        autosize=True,
         mapbox={
-            "style": mapbox_style,
-            "center": go.layout.mapbox.Center(**get_center_lat_lon(df)),
+            "center": go.layout.mapbox.Center(**center),
             "pitch": 0,
             "zoom": zoom,
         },
-        mapbox_accesstoken=st.secrets["mapbox_api_key"],
+    )
+    return fig
+
+
+def style_map_figure(
+    fig: go.Figure,
+    mapbox_style: str = "carto-positron",
+    color_scale: str = "viridis",
+) -> go.Figure:
+    """Applies the styling options to a map of `build_map_traces`, in place."""
+    fig.update_layout(
+        margin={"l": 0, "t": 0, "b": 0, "r": 0},
+        height=800,
+        autosize=True,
+        mapbox_style=mapbox_style,
+        coloraxis_colorscale=color_scale,
         coloraxis_colorbar={
             "len": 0.5,
             "xanchor": "right",
@@ -128,17 +242,129 @@ def show_map(
             "thickness": 10,
         },
     )
+    return fig
+
+
+def build_map_figure(
+    df: pl.DataFrame,
+    color_attribute: str = DefaultNamespace.default_color_by,
+    mapbox_style: str = "carto-positron",
+    color_scale: str = "viridis",
+    significance: np.ndarray | None = None,
+    bounds: tuple[float, float, float, float] | None = None,
+) -> go.Figure:
+    """Map of the tracks of all files, see `build_map_traces`."""
+    fig = build_map_traces(df, color_attribute, significance, bounds)
+    return style_map_figure(fig, mapbox_style, color_scale)
+
+
+@memory_cached
+def get_map_traces(handle: DatasetHandle, color_attribute: str) -> go.Figure:
+    """Unstyled map of a dataset, reused when only styling options change."""
+    logger.info("Creating map.")
+    return build_map_traces(
+        get_frame(handle),
+        color_attribute,
+        significance=get_track_significance(handle),
+        bounds=get_spatial_index(handle).bounds(),
+    )
 
+
+def show_map(
+    handle: DatasetHandle,
+    color_attribute: str = DefaultNamespace.default_color_by,
+    mapbox_style: str = "carto-positron",
+    color_scale: str = "viridis",
+) -> None:
+    """Shows the cached map traces, styled."""
+    # styles a copy, so that the cached traces are not changed
+    fig = style_map_figure(
+        go.Figure(get_map_traces(handle, color_attribute)), mapbox_style, color_scale
+    )
+    fig.update_layout(mapbox_accesstoken=st.secrets["mapbox_api_key"])
     st.plotly_chart(fig, use_container_width=True)
 
 
-@st.cache_data
+def build_density_figure(
+    density: pl.DataFrame, x: str, y: str, color: str, color_scale: str = "viridis"
+) -> go.Figure:
+    """Scatter of the bins of `bin_2d`, instead of the individual points.
+
+    Numeric colors are drawn as a heatmap of the mean color of every bin,
+    otherwise every color group is a trace of markers sized by their count.
+    """
+    fig = go.Figure()
+    if density["color"].is_numeric():
+        fig.add_trace(
+            go.Heatmap(
+                x=density["x"].to_numpy(),
+                y=density["y"].to_numpy(),
+                z=density["color"].to_numpy(),
+                text=density["count"].to_numpy(),
+                colorscale=color_scale,
+                colorbar={"title": color},
+                hovertemplate=f"{x}=%{{x}}<br>{y}=%{{y}}<br>{color}=%{{z}}"
+                "<br>count=%{text}<extra></extra>",
+            )
+        )
+    else:
+        largest = max(density["count"].max() or 1, 1)
+        colors = px.colors.qualitative.Plotly
+        for i, (group, bins) in enumerate(
+            density.groupby("color", maintain_order=True)
+        ):
+            fig.add_trace(
+                go.Scattergl(
+                    x=bins["x"].to_numpy(),
+                    y=bins["y"].to_numpy(),
+                    name=str(group),
+                    mode="markers",
+                    text=bins["count"].to_numpy(),
+                    hovertemplate="count=%{text}",
+                    marker={
+                        "size": bins["count"].to_numpy(),
+                        "sizemode": "area",
+                        "sizeref": 2 * largest / 12**2,
+                        "sizemin": 1,
+                        "color": colors[i % len(colors)],
+                        "opacity": 0.6,
+                    },
+                )
+            )
+    fig.update_layout(width=800, xaxis_title=x, yaxis_title=y, legend_title_text=color)
+    return fig
+
+
+@memory_cached
+def get_scatter_figure(
+    handle: DatasetHandle,
+    x: str,
+    y: str,
+    color: str = DefaultNamespace.default_color_by,
+    density_points: int = DefaultNamespace.scatter_density_points,
+    bins: int = DefaultNamespace.scatter_density_bins,
+) -> go.Figure:
+    """Scatter of x vs y, binned into a density above `density_points` rows."""
+    logger.info("Creating x vs y.")
+    df = get_frame(handle)
+    if len(df) > density_points and df[x].is_numeric() and df[y].is_numeric():
+        density = get_density(handle, x, y, color, bins)
+        fig = build_density_figure(density, x, y, color)
+    else:
+        fig = px.scatter(
+            to_plotly(df, [x, y, color]), x=x, y=y, color=color, width=800, opacity=0.9
+        )
+    return fig
+
+
 def show_scatter(
-    df: pd.DataFrame,
+    handle: DatasetHandle,
     x: str,
     y: str,
     color: str = DefaultNamespace.default_color_by,
+    density_points: int = DefaultNamespace.scatter_density_points,
+    bins: int = DefaultNamespace.scatter_density_bins,
 ) -> None:
-    logger.info("Creating x vs y.")
-    fig = px.scatter(df, x=x, y=y, color=color, width=800, opacity=0.9)
+    """Shows the scatter of `get_scatter_figure`."""
+    fig = get_scatter_figure(handle, x, y, color, density_points, bins)
     st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,49 @@
+"""2D histograms of two columns, for scatter plots of many points.
+
+All groups share the same bins over the range of x and y, so that their
+densities can be drawn on top of each other.
+"""
+import polars as pl
+
+from wahoosnowmaker.app.datastore import get_frame
+from wahoosnowmaker.app.memory_cache import memory_cached
+from wahoosnowmaker.parser.dataset import DatasetHandle
+
+
+def bin_2d(df: pl.DataFrame, x: str, y: str, color: str, bins: int) -> pl.DataFrame:
+    """Counts of the points of every bin and color group.
+
+    Returns the bin centers `x` and `y`, the point `count` and, if `color` is
+    numeric, the `color` mean of the bin, otherwise the `color` group.
+    """
+    numeric_color = df[color].is_numeric()
+    points = df.select(
+        pl.col(x).cast(pl.Float64).alias("x"),
+        pl.col(y).cast(pl.Float64).alias("y"),
+        pl.col(color).alias("color"),
+    ).drop_nulls(["x", "y"])
+    if points.height == 0:
+        return points.with_columns(pl.lit(0, pl.UInt32).alias("count"))
+
+    def bin_index(name: str) -> pl.Expr:
+        low, high = points[name].min(), points[name].max()
+        width = (high - low) / bins if high > low else 1.0
+        index = ((pl.col(name) - low) / width).floor().clip(0, bins - 1)
+        return (low + (index + 0.5) * width).alias(name)
+
+    binned = points.with_columns([bin_index("x"), bin_index("y")])
+    if numeric_color:
+        return binned.groupby(["x", "y"]).agg(
+            [pl.count().alias("count"), pl.col("color").mean()]
+        )
+    return binned.groupby(["color", "x", "y"], maintain_order=True).agg(
+        pl.count().alias("count")
+    )
+
+
+@memory_cached
+def get_density(
+    handle: DatasetHandle, x: str, y: str, color: str, bins: int
+) -> pl.DataFrame:
+    """`bin_2d` of a dataset, cached per dataset version, columns and bins."""
+    return bin_2d(get_frame(handle), x, y, color, bins)
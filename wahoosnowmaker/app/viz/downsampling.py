@@ -0,0 +1,71 @@
+"""Downsampling of chart traces to a point budget.
+
+Both methods return the indices of the kept samples, in order, and always
+keep the first and the last sample of a trace. `x` has to be sorted.
+
+- `min-max` splits a trace into buckets of equal sample count and keeps the
+  minimum and the maximum of every bucket, so no peak is lost.
+- `lttb` (Largest Triangle Three Buckets, Steinarsson 2013) keeps the sample
+  of every bucket that spans the largest triangle with the previously kept
+  sample and the mean of the next bucket, which follows the visual shape.
+"""
+import numpy as np
+
+
+def min_max_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the minimum and maximum of `n_out // 2` buckets."""
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+    size = int(np.ceil((n - 2) / ((n_out - 2) // 2)))
+    n_buckets = int(np.ceil((n - 2) / size))
+    buckets = np.full(n_buckets * size, np.nan)
+    buckets[: n - 2] = y[1:-1]
+    buckets = buckets.reshape(n_buckets, size)
+    # all-nan buckets of gaps keep their first sample
+    valid = ~np.isnan(buckets).all(axis=1)
+    filled = np.where(valid[:, None], buckets, 0)
+    starts = np.arange(n_buckets) * size + 1
+    minima = starts + np.nanargmin(filled, axis=1)
+    maxima = starts + np.nanargmax(filled, axis=1)
+    return np.unique(np.concatenate([[0, n - 1], minima, maxima]))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the samples kept by Largest Triangle Three Buckets."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[end:next_end].mean()
+        mean_y = y[end:next_end].mean()
+        a = kept[i]
+        areas = np.abs(
+            (x[a] - mean_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (mean_y - y[a])
+        )
+        kept[i + 1] = start + np.argmax(np.nan_to_num(areas, nan=-1))
+    return kept
+
+
+def downsample_indices(
+    x: np.ndarray, y: np.ndarray, n_points: int, method: str
+) -> np.ndarray:
+    """Indices of the samples of a trace to keep, about `n_points` of them.
+
+    `method` is one of `DefaultNamespace.chart_downsampling_methods`. With
+    `"none"` or a non-positive `n_points`, all samples are kept.
+    """
+    if method == "none" or n_points <= 0:
+        return np.arange(len(y))
+    if method == "lttb":
+        return lttb_indices(x, y, n_points)
+    if method == "min-max":
+        return min_max_indices(y, n_points)
+    raise ValueError(f"Unknown downsampling method {method}")
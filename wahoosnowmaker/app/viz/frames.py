@@ -0,0 +1,40 @@
+"""Access to the polars frames of a dataset for plotting."""
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+
+def row_indices_by(df: pl.DataFrame, by: str) -> dict[str, np.ndarray]:
+    """Row numbers of every group of `by`, in order of first appearance."""
+    groups = (
+        df.select(pl.col(by))
+        .with_row_count("row")
+        .groupby(by, maintain_order=True)
+        .agg(pl.col("row"))
+    )
+    return {
+        str(name): rows.to_numpy().astype(np.int64)
+        for name, rows in zip(groups[by], groups["row"], strict=True)
+    }
+
+
+def to_plotly(df: pl.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """Pandas view of some columns for plotly express, backed by Arrow."""
+    return df.select(list(dict.fromkeys(columns))).to_pandas(
+        use_pyarrow_extension_array=True
+    )
+
+
+def to_arrow(df: pl.DataFrame) -> pa.Table:
+    """Arrow table for streamlit, without copying the data.
+
+    Categoricals become dictionaries with int32 instead of uint32 indices,
+    which pyarrow cannot convert to pandas.
+    """
+    table = df.to_arrow()
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            dictionary = pa.dictionary(pa.int32(), field.type.value_type)
+            table = table.set_column(i, field.name, table[i].cast(dictionary))
+    return table
@@ -1,13 +1,11 @@
 import numpy as np
-import pandas as pd
-import streamlit as st
+import polars as pl
 
 from wahoosnowmaker.namespace import DefaultNamespace
 
 
-@st.cache_data
 def get_center_lat_lon(
-    df: pd.DataFrame,
+    df: pl.DataFrame,
     lat: str = DefaultNamespace.column_latitude,
     lon: str = DefaultNamespace.column_longitude,
 ):
@@ -19,7 +17,6 @@ def get_center_lat_lon(
 
 
 # See: https://community.plotly.com/t/dynamic-zoom-for-mapbox/32658/10
-@st.cache_data
 def get_zoom_level(longitudes=None, latitudes=None, fudge: float = 1):
     """
     Basic framework adopted from Krichardson.
@@ -41,7 +38,7 @@ def get_zoom_level(longitudes=None, latitudes=None, fudge: float = 1):
     b_box = {}
     b_box["height"] = latitudes.max() - latitudes.min()
     b_box["width"] = longitudes.max() - longitudes.min()
-    b_box["center"] = (np.mean(longitudes), np.mean(latitudes))
+    b_box["center"] = (longitudes.mean(), latitudes.mean())
 
     # get the area of the bounding box in order to calculate a zoom-level
     area = b_box["height"] * b_box["width"]
@@ -59,3 +56,15 @@ def get_zoom_level(longitudes=None, latitudes=None, fudge: float = 1):
     )
 
     return zoom
+
+
+def get_center_and_zoom(
+    bounds: tuple[float, float, float, float], fudge: float = 1
+) -> tuple[dict, float]:
+    """Center and zoom level of a lat_min, lat_max, lon_min, lon_max box."""
+    lat_min, lat_max, lon_min, lon_max = bounds
+    center = {"lat": (lat_min + lat_max) / 2, "lon": (lon_min + lon_max) / 2}
+    zoom = get_zoom_level(
+        np.array([lat_min, lat_max]), np.array([lon_min, lon_max]), fudge=fudge
+    )
+    return center, zoom
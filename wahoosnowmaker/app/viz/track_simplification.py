@@ -0,0 +1,119 @@
+"""Douglas-Peucker simplification of GPS tracks for every map zoom level.
+
+Instead of simplifying a track once per tolerance, every vertex is assigned
+the tolerance below which Douglas-Peucker keeps it, its significance. The
+level of detail for a zoom level is then just the vertices whose significance
+reaches the size of a fraction of a pixel at that zoom. Significances are
+computed once per dataset version and cached, picking a level of detail is a
+comparison.
+"""
+import numpy as np
+import polars as pl
+
+from wahoosnowmaker.app.datastore import get_frame
+from wahoosnowmaker.app.memory_cache import memory_cached
+from wahoosnowmaker.app.viz.frames import row_indices_by
+from wahoosnowmaker.namespace import DefaultNamespace
+from wahoosnowmaker.parser.dataset import DatasetHandle
+
+# mapbox renders the world on a 512 pixel tile at zoom 0
+TILE_SIZE = 512
+# vertices closer to the simplified line than this are invisible
+PIXEL_TOLERANCE = 0.5
+# significances below the tolerance of this zoom are not computed
+FINEST_ZOOM = 20
+
+
+def zoom_tolerance(zoom: float, pixels: float = PIXEL_TOLERANCE) -> float:
+    """Size of `pixels` pixels at a mapbox zoom level, in degrees."""
+    return pixels * 360 / (TILE_SIZE * 2**zoom)
+
+
+def douglas_peucker_significance(
+    x: np.ndarray, y: np.ndarray, min_tolerance: float = 0
+) -> np.ndarray:
+    """Largest tolerance at which Douglas-Peucker keeps each vertex.
+
+    The end points are always kept and have an infinite significance. A
+    vertex never has a larger significance than the vertex that split its
+    segment, so the levels of detail are nested. Segments whose vertices are
+    all within `min_tolerance` are not split further, their significance is 0.
+    """
+    n = len(x)
+    significance = np.zeros(n)
+    if n == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1 : last] - x[first], y[first + 1 : last] - y[first]
+        length = np.hypot(dx, dy)
+        if length > 0:
+            distances = np.abs(px * dy - py * dx) / length
+        else:
+            distances = np.hypot(px, py)
+        split = int(np.argmax(distances))
+        distance = distances[split]
+        if distance <= min_tolerance:
+            continue
+        split += first + 1
+        significance[split] = min(distance, parent)
+        stack.append((first, split, significance[split]))
+        stack.append((split, last, significance[split]))
+    return significance
+
+
+def track_significance(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Significance of the vertices of one track, in degrees of latitude.
+
+    Longitudes are scaled to the length of a degree of latitude at the
+    track's mean latitude. Missing positions split the track into parts,
+    they are kept to preserve the gaps of the line.
+    """
+    significance = np.full(len(lat), np.inf)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if not valid.any():
+        return significance
+    scale = np.cos(np.radians(np.mean(lat[valid])))
+    bounds = np.flatnonzero(np.diff(np.concatenate([[0], valid, [0]]).astype(int)))
+    for start, end in zip(bounds[::2], bounds[1::2], strict=True):
+        significance[start:end] = douglas_peucker_significance(
+            lon[start:end] * scale,
+            lat[start:end],
+            min_tolerance=zoom_tolerance(FINEST_ZOOM),
+        )
+    return significance
+
+
+def track_significances(
+    df: pl.DataFrame,
+    lat: str = DefaultNamespace.column_latitude,
+    lon: str = DefaultNamespace.column_longitude,
+    by: str = DefaultNamespace.column_file,
+) -> np.ndarray:
+    """Significance of every row, computed separately for every file."""
+    significance = np.empty(len(df))
+    lats = df[lat].cast(pl.Float64).to_numpy()
+    lons = df[lon].cast(pl.Float64).to_numpy()
+    for index in row_indices_by(df, by).values():
+        significance[index] = track_significance(lats[index], lons[index])
+    return significance
+
+
+@memory_cached
+def get_track_significance(handle: DatasetHandle) -> np.ndarray:
+    """Significances of the rows of a dataset, once per content version."""
+    return track_significances(get_frame(handle))
+
+
+def simplify_tracks(
+    df: pl.DataFrame, zoom: float, significance: np.ndarray | None = None
+) -> pl.DataFrame:
+    """Rows of the tracks that are visible at a mapbox zoom level."""
+    if significance is None:
+        significance = track_significances(df)
+    return df.filter(pl.Series(significance >= zoom_tolerance(zoom)))
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 
 import plotly.express as px
@@ -9,8 +10,19 @@ class Namespace:
     domain = """https://wahoofit.streamlit.app"""
     # domain = """http://localhost:8501"""
 
+    data_folder = "data"
+    catalog_file_name = "catalog.json"
+    catalog_page_size = 20
+    blob_folder = os.path.join(data_folder, ".blobs")
+    blob_chunk_size = 2**20
+    blob_tmp_grace = 3600.0
     name_file_name = "name.txt"
     notes_file_name = "notes.txt"
+    manifest_file_name = "manifest.json"
+    files_file_name = "files.parquet"
+    summary_file_name = "summary.parquet"
+    frame_file_name = "frame.arrow"
+    column_file = "file"
     column_elapsed_time = "Elapsed time [s]"
     column_second = "Second [s]"
     column_power = "Power [W]"
@@ -38,8 +50,26 @@ class Namespace:
         column_temperature,
     ]
     default_map_style = "carto-positron"
-    default_color_by = "file"
+    map_detail_zoom_levels = 2
+    default_color_by = column_file
     default_colorscale = "viridis"
+    chart_downsampling_methods = ["min-max", "lttb", "none"]
+    default_chart_downsampling = "min-max"
+    default_chart_points = 2000
+    chart_webgl_points = 1000
+    scatter_density_points = 100_000
+    scatter_density_bins = 100
+    alignment_methods = ["linear", "previous", "nearest"]
+    # grid step and largest gap to interpolate over, per column to align on
+    alignment_resolution = {column_elapsed_time: 1.0, column_distance: 10.0}
+    alignment_max_gap = {column_elapsed_time: 10.0, column_distance: 100.0}
+
+    parse_folder_workers = os.cpu_count() or 1
+    parse_pool_min_bytes = 8 * 2**20
+    ingest_threads = 1
+    ingest_poll_interval = 0.2
+    cache_memory_budget = 1024 * 2**20
+    spatial_index_chunk_size = 256
 
     streamlit_layout = "centered"
     streamlit_initial_sidebar_state = "collapsed"
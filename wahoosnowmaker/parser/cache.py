@@ -0,0 +1,149 @@
+"""Parquet sidecar cache of parsed .FIT files.
+
+The parsed records of `activity.fit` are stored next to it as
+`activity.fit.<key>.parquet`. The key hashes the file content together with
+the parser and pipeline versions, so a changed file or a changed parsing
+pipeline never reads a stale sidecar.
+
+Sidecars can also be hard-linked by key into a `shared_folder`, in the app
+the parsed folder of the blob store of uploads, so that files with the same
+content share one parsed result wherever they are.
+"""
+import glob
+import hashlib
+import os
+from collections.abc import Collection, Iterable
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.parser.fitparser import FitParser
+from wahoosnowmaker.parser.pipes import PIPELINE_VERSION
+
+cache_ending = ".parquet"
+
+
+def file_digest(fitfile: str) -> str:
+    """SHA-256 of the file content."""
+    digest = hashlib.sha256()
+    with open(fitfile, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(fitfile: str, parser: FitParser, digest: str | None = None) -> str:
+    """Cache key of a file, pass `digest` if the content hash is known."""
+    digest = digest or file_digest(fitfile)
+    key = f"{digest}:{parser.cache_id}:{PIPELINE_VERSION}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def cache_file(fitfile: str, key: str) -> str:
+    return f"{fitfile}.{key}{cache_ending}"
+
+
+def _link(source: str, target: str) -> bool:
+    try:
+        os.link(source, target)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not link {source} to {target}: {e}")
+        return False
+
+
+def share_cached(fitfile: str, key: str, shared_folder: str | None) -> None:
+    """Links the sidecar into `shared_folder`, if it exists."""
+    if shared_folder is None or not os.path.isdir(shared_folder):
+        return
+    shared = os.path.join(shared_folder, key + cache_ending)
+    if not os.path.exists(shared):
+        _link(cache_file(fitfile, key), shared)
+
+
+def load_cached(
+    fitfile: str,
+    key: str,
+    columns: Collection[str] | None = None,
+    shared_folder: str | None = None,
+) -> pl.DataFrame | None:
+    path = cache_file(fitfile, key)
+    if not os.path.exists(path):
+        # e.g. a file uploaded before, whose content was parsed in another folder
+        if shared_folder is None:
+            return None
+        shared = os.path.join(shared_folder, key + cache_ending)
+        if not (os.path.exists(shared) and _link(shared, path)):
+            return None
+    try:
+        if columns is not None:
+            names = pq.read_schema(path).names
+            return pl.read_parquet(path, columns=[c for c in names if c in columns])
+        return pl.read_parquet(path)
+    except Exception as e:
+        logger.warning(f"Could not read cache {path}: {e}")
+        return None
+
+
+def save_cached(
+    fitfile: str, key: str, df: pl.DataFrame, shared_folder: str | None = None
+) -> None:
+    remove_cached(fitfile)
+    path = cache_file(fitfile, key)
+    try:
+        # write to a temporary file first so readers never see partial files
+        df.write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        share_cached(fitfile, key, shared_folder)
+    except Exception as e:
+        logger.warning(f"Could not write cache {path}: {e}")
+
+
+class CacheSchemaError(Exception):
+    pass
+
+
+def save_cached_batches(
+    fitfile: str,
+    key: str,
+    batches: Iterable[pl.DataFrame],
+    shared_folder: str | None = None,
+) -> None:
+    """Writes batches to the sidecar one row group at a time.
+
+    The schema is taken from the first batch. Later batches may lack columns,
+    but a new column or dtype raises `CacheSchemaError` and nothing is written.
+    """
+    remove_cached(fitfile)
+    path = cache_file(fitfile, key)
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                schema = batch.schema
+                writer = pq.ParquetWriter(path + ".tmp", batch.to_arrow().schema)
+            if any(schema.get(c) != dtype for c, dtype in batch.schema.items()):
+                raise CacheSchemaError(f"Schema of {fitfile} changes between batches")
+            batch = batch.with_columns(
+                [
+                    pl.lit(None, dtype).alias(column)
+                    for column, dtype in schema.items()
+                    if column not in batch.columns
+                ]
+            ).select(list(schema))
+            writer.write_table(batch.to_arrow())
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(path + ".tmp")
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(path + ".tmp", path)
+        share_cached(fitfile, key, shared_folder)
+
+
+def remove_cached(fitfile: str) -> None:
+    for path in glob.glob(glob.escape(fitfile) + ".*" + cache_ending):
+        os.remove(path)
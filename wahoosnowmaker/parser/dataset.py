@@ -0,0 +1,404 @@
+"""Incrementally maintained dataframe of all .FIT files in a dataset folder.
+
+On `refresh`, only files that are new or changed according to the manifest
+are parsed. The codes of the categorical `file` column index the rows of
+`Dataset.files`, and `Dataset.handle` changes whenever the content does.
+"""
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+import polars as pl
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.namespace import Namespace
+from wahoosnowmaker.parser.cache import (
+    cache_file,
+    cache_key,
+    file_digest,
+    load_cached,
+)
+from wahoosnowmaker.parser.fitdecoder import decode_file_id
+from wahoosnowmaker.parser.fitparser import FitParser
+from wahoosnowmaker.parser.fitparser import GarminFitSDKParser as Parser
+from wahoosnowmaker.parser.parse_folder import (
+    concat_files,
+    iter_parse_files,
+    parse_file,
+)
+from wahoosnowmaker.parser.pipes import PIPELINE_VERSION, drop_columns_all_nans
+from wahoosnowmaker.parser.spatial_index import SpatialIndex
+from wahoosnowmaker.parser.statistics import describe_by
+
+
+@dataclass
+class FileState:
+    mtime_ns: int
+    size: int
+    digest: str
+
+    @classmethod
+    def of(cls, fitfile: str, digest: str | None = None) -> "FileState":
+        """Current state of a file on disk."""
+        stat = os.stat(fitfile)
+        return cls(stat.st_mtime_ns, stat.st_size, digest or file_digest(fitfile))
+
+    def matches(self, fitfile: str) -> bool:
+        """Whether the file still has the recorded mtime and size."""
+        stat = os.stat(fitfile)
+        return (self.mtime_ns, self.size) == (stat.st_mtime_ns, stat.st_size)
+
+
+@dataclass(frozen=True)
+class DatasetHandle:
+    folder: str
+    fingerprint: str
+
+
+class Dataset:
+    def __init__(
+        self,
+        folder: str,
+        fit_ending: str = "/*.fit",
+        parser: FitParser | None = None,
+        n_workers: int = 1,
+        shared_folder: str | None = None,
+    ):
+        self.folder = folder
+        self.fit_ending = fit_ending
+        self.parser = parser or Parser()
+        self.n_workers = n_workers
+        # sidecars are shared with other datasets there, see `parser.cache`
+        self.shared_folder = shared_folder
+        self.states: dict[str, FileState] = self._load_manifest()
+        # files with a parsed frame, of which only the new ones are in memory
+        self.parsed: set[str] = set()
+        self.frames: dict[str, pl.DataFrame] = {}
+        self.failed: set[str] = set()
+        self.infos: dict[str, dict] = self._load_infos()
+        self.summaries: dict[str, pl.DataFrame] = self._load_summaries()
+        self._df: pl.DataFrame | None = None
+        self._files: pl.DataFrame | None = None
+        self._summary: pl.DataFrame | None = None
+        self._spatial_index: SpatialIndex | None = None
+        self._fingerprint: str | None = None
+        self._lock = threading.RLock()
+
+    @property
+    def manifest_file(self) -> str:
+        """Path of the manifest in the dataset folder."""
+        return os.path.join(self.folder, Namespace.manifest_file_name)
+
+    def _load_manifest(self) -> dict[str, FileState]:
+        if not os.path.exists(self.manifest_file):
+            return {}
+        try:
+            with open(self.manifest_file) as f:
+                return {
+                    os.path.join(self.folder, name): FileState(**state)
+                    for name, state in json.load(f).items()
+                }
+        except Exception as e:
+            logger.warning(f"Could not read manifest of {self.folder}: {e}")
+            return {}
+
+    def _save_manifest(self) -> None:
+        manifest = {
+            os.path.basename(fitfile): asdict(state)
+            for fitfile, state in self.states.items()
+        }
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def _load_infos(self) -> dict[str, dict]:
+        path = self._path(Namespace.files_file_name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            return {
+                self._path(info[Namespace.column_file]): info
+                for info in pl.read_parquet(path).to_dicts()
+            }
+        except Exception as e:
+            logger.warning(f"Could not read file summaries of {self.folder}: {e}")
+            return {}
+
+    def _load_summaries(self) -> dict[str, pl.DataFrame]:
+        path = self._path(Namespace.summary_file_name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            summary = pl.read_parquet(path)
+        except Exception as e:
+            logger.warning(f"Could not read column summaries of {self.folder}: {e}")
+            return {}
+        return {
+            self._path(name): drop_columns_all_nans(df)
+            for name, df in summary.groupby(Namespace.column_file, maintain_order=True)
+        }
+
+    def _save_summaries(self) -> None:
+        for name, df in [
+            (Namespace.files_file_name, self.files),
+            (Namespace.summary_file_name, self.summary),
+        ]:
+            df.write_parquet(self._path(name + ".tmp"))
+            os.replace(self._path(name + ".tmp"), self._path(name))
+
+    def _reuse(self, fitfile: str) -> bool:
+        """Tries to reuse the parsed frame of an unchanged file."""
+        state = self.states.get(fitfile)
+        if state is None or not state.matches(fitfile):
+            return False
+        if fitfile in self.parsed or fitfile in self.failed:
+            return True
+        key = cache_key(fitfile, self.parser, state.digest)
+        if os.path.exists(cache_file(fitfile, key)):
+            # read by `_frame` only if the mapped frame has to be rebuilt
+            self.parsed.add(fitfile)
+            return True
+        df = load_cached(fitfile, key, shared_folder=self.shared_folder)
+        if df is not None:
+            self.parsed.add(fitfile)
+            self.frames[fitfile] = df
+        return df is not None
+
+    def _frame(self, fitfile: str) -> pl.DataFrame:
+        """Parsed frame of a file, from memory or reloaded from its sidecar."""
+        df = self.frames.get(fitfile)
+        if df is None:
+            key = cache_key(fitfile, self.parser, self.states[fitfile].digest)
+            df = load_cached(fitfile, key, shared_folder=self.shared_folder)
+        if df is None:
+            # e.g. the sidecar could not be written
+            df = parse_file(fitfile, self.parser, shared_folder=self.shared_folder)
+        if df is None:
+            raise ValueError(f"Could not reload {fitfile}")
+        return df
+
+    def _parse(
+        self, fitfiles: list[str], progress: Callable[[int, int], None] | None
+    ) -> None:
+        if progress is not None:
+            progress(0, len(fitfiles))
+        for done, (fitfile, df) in enumerate(
+            zip(
+                fitfiles,
+                iter_parse_files(
+                    fitfiles,
+                    self.parser,
+                    self.n_workers,
+                    shared_folder=self.shared_folder,
+                ),
+                strict=True,
+            ),
+            start=1,
+        ):
+            self.states[fitfile] = FileState.of(fitfile)
+            self.infos.pop(fitfile, None)
+            self.summaries.pop(fitfile, None)
+            if df is not None:
+                self.parsed.add(fitfile)
+                self.frames[fitfile] = df
+                self.failed.discard(fitfile)
+            else:
+                self.parsed.discard(fitfile)
+                self.frames.pop(fitfile, None)
+                self.failed.add(fitfile)
+            if progress is not None:
+                progress(done, len(fitfiles))
+
+    def refresh(self, progress: Callable[[int, int], None] | None = None) -> bool:
+        """Brings the dataset up to date, returns whether anything changed.
+
+        `progress` is called with the number of parsed files and the number of
+        files to parse, before parsing and after every file.
+        """
+        with self._lock:
+            fitfiles = sorted(glob.glob(self.folder + self.fit_ending))
+            removed = (set(self.states) | self.parsed) - set(fitfiles)
+            for fitfile in removed:
+                self.states.pop(fitfile, None)
+                self.parsed.discard(fitfile)
+                self.frames.pop(fitfile, None)
+                self.infos.pop(fitfile, None)
+                self.summaries.pop(fitfile, None)
+                self.failed.discard(fitfile)
+
+            n_parsed = len(self.parsed)
+            to_parse = [f for f in fitfiles if not self._reuse(f)]
+            self._parse(to_parse, progress)
+
+            changed = len(removed) > 0 or len(to_parse) > 0
+            if changed:
+                self._save_manifest()
+            if changed or len(self.parsed) != n_parsed:
+                self._df = None
+                self._spatial_index = None
+                self._files = None
+                self._summary = None
+                self._fingerprint = None
+
+            stale = {f for f in self.infos if f not in self.parsed}
+            stale |= {f for f in self.summaries if f not in self.parsed}
+            missing = [
+                f for f in self.parsed if f not in self.infos or f not in self.summaries
+            ]
+            for fitfile in stale:
+                self.infos.pop(fitfile, None)
+                self.summaries.pop(fitfile, None)
+            for fitfile in missing:
+                self._summarize(fitfile)
+            if len(stale) > 0 or len(missing) > 0:
+                self._files = None
+                self._summary = None
+            if changed or len(stale) > 0 or len(missing) > 0:
+                self._save_summaries()
+            return changed
+
+    @property
+    def handle(self) -> DatasetHandle:
+        """Identifies the dataset and its current content."""
+        with self._lock:
+            if self._fingerprint is None:
+                digest = hashlib.sha256(
+                    f"{self.parser.cache_id}:{PIPELINE_VERSION}".encode()
+                )
+                for fitfile in sorted(self.parsed):
+                    digest.update(f"{fitfile}:{self.states[fitfile].digest}".encode())
+                self._fingerprint = digest.hexdigest()[:16]
+            return DatasetHandle(self.folder, self._fingerprint)
+
+    def _concat(self) -> pl.DataFrame:
+        fitfiles = sorted(self.parsed)
+        return (
+            concat_files([self._frame(f).lazy() for f in fitfiles], fitfiles)
+            .collect()
+            .pipe(drop_columns_all_nans)
+        )
+
+    def _frame_file(self, fingerprint: str) -> str:
+        stem, ending = os.path.splitext(Namespace.frame_file_name)
+        return self._path(f"{stem}.{fingerprint}{ending}")
+
+    def _open_frame(self) -> pl.DataFrame:
+        """`df` memory-mapped from its Arrow IPC file, written if missing."""
+        path = self._frame_file(self.handle.fingerprint)
+        if not os.path.exists(path):
+            # other processes may write the same file at the same time
+            tmp = f"{path}.{os.getpid()}.tmp"
+            self._concat().write_ipc(tmp, compression="uncompressed")
+            os.replace(tmp, path)
+            written = os.stat(path).st_mtime_ns
+            for stale in glob.glob(self._frame_file("*")):
+                # frames written later may be of newer content in another
+                # process, and another process may have removed a stale one
+                with contextlib.suppress(FileNotFoundError):
+                    if stale != path and os.stat(stale).st_mtime_ns < written:
+                        os.remove(stale)
+        return pl.read_ipc(path, memory_map=True)
+
+    @property
+    def df(self) -> pl.DataFrame:
+        """All parsed files in file name order, rebuilt only after changes.
+
+        The frame is stored as an uncompressed Arrow IPC file per content
+        version and memory-mapped, so that all processes that open the same
+        dataset share its pages instead of holding private copies.
+        """
+        with self._lock:
+            if self._df is None:
+                if len(self.parsed) == 0:
+                    self._df = self._concat()
+                else:
+                    try:
+                        self._df = self._open_frame()
+                        # the mapped frame holds all records
+                        self.frames.clear()
+                    except Exception as e:
+                        logger.warning(f"Could not map frame of {self.folder}: {e}")
+                        self._df = self._concat()
+            return self._df
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """Bounding boxes of the tracks in `df`, per file and per chunk."""
+        with self._lock:
+            if self._spatial_index is None:
+                self._spatial_index = SpatialIndex.build(self.df)
+            return self._spatial_index
+
+    def _summarize(self, fitfile: str) -> None:
+        df = self._frame(fitfile)
+        name = os.path.basename(fitfile)
+        try:
+            device = decode_file_id(fitfile)
+        except Exception as e:
+            logger.warning(f"Could not read device of {fitfile}: {e}")
+            device = {}
+
+        def aggregate(column: str, how: str) -> float | None:
+            if column not in df.columns:
+                return None
+            return getattr(df[column], how)()
+
+        elapsed_max = aggregate(Namespace.column_elapsed_time, "max")
+        elapsed_min = aggregate(Namespace.column_elapsed_time, "min")
+        self.infos[fitfile] = {
+            Namespace.column_file: name,
+            "size": self.states[fitfile].size,
+            "manufacturer": str(device.get("manufacturer", "")),
+            "product": str(device.get("product", "")),
+            "start": aggregate(Namespace.column_timestamp, "min"),
+            "records": df.height,
+            "duration": (
+                None if elapsed_max is None else float(elapsed_max - elapsed_min)
+            ),
+            "distance": aggregate(Namespace.column_distance, "max"),
+            "lat_min": aggregate(Namespace.column_latitude, "min"),
+            "lat_max": aggregate(Namespace.column_latitude, "max"),
+            "lon_min": aggregate(Namespace.column_longitude, "min"),
+            "lon_max": aggregate(Namespace.column_longitude, "max"),
+        }
+        self.summaries[fitfile] = describe_by(
+            df.with_columns(pl.lit(name).alias(Namespace.column_file))
+        )
+
+    @property
+    def files(self) -> pl.DataFrame:
+        """One row per parsed file, row `i` is the file with code `i`.
+
+        Besides device and size, the rows hold the duration [s], distance [m]
+        and bounding box of every file.
+        """
+        with self._lock:
+            if self._files is None:
+                infos = [self.infos[fitfile] for fitfile in sorted(self.parsed)]
+                self._files = (
+                    pl.from_dicts(infos, infer_schema_length=None)
+                    if len(infos) > 0
+                    else pl.DataFrame()
+                )
+            return self._files
+
+    @property
+    def summary(self) -> pl.DataFrame:
+        """Statistics of the numeric columns, see `describe_by`, of all files."""
+        with self._lock:
+            if self._summary is None:
+                summaries = [self.summaries[f] for f in sorted(self.parsed)]
+                self._summary = (
+                    pl.concat(summaries, how="diagonal")
+                    if len(summaries) > 0
+                    else pl.DataFrame()
+                )
+            return self._summary
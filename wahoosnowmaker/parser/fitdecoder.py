@@ -0,0 +1,299 @@
+"""Columnar decoder for the `record` messages of a .FIT file.
+
+Instead of building one Python dict per message, the file is walked once to
+collect the byte offsets of all `record` data messages. Every field is then
+gathered for all records at once with numpy fancy indexing and handed to
+polars as an Arrow array.
+
+Only scalar fields are decoded. Arrays, strings, developer fields and
+component expansion (e.g. `speed` -> `enhanced_speed`) are not supported.
+"""
+import mmap
+import struct
+import traceback
+import warnings
+from array import array
+from collections.abc import Collection, Iterator
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+with warnings.catch_warnings():  # Garmin has a SyntaxWarning in the decoder.py file
+    warnings.filterwarnings("ignore", category=SyntaxWarning)
+    from garmin_fit_sdk import Profile
+
+from wahoosnowmaker.parser.records_naming_mapping import is_requested
+
+FIT_EPOCH_S = 631065600
+FILE_ID_MESG_NUM = 0
+RECORD_MESG_NUM = 20
+TIMESTAMP_FIELD_NUM = 253
+
+# base type number -> (numpy type code, size in bytes, invalid value)
+BASE_TYPES: dict[int, tuple[str, int, float]] = {
+    0x00: ("u1", 1, 0xFF),  # enum
+    0x01: ("i1", 1, 0x7F),  # sint8
+    0x02: ("u1", 1, 0xFF),  # uint8
+    0x03: ("i2", 2, 0x7FFF),  # sint16
+    0x04: ("u2", 2, 0xFFFF),  # uint16
+    0x05: ("i4", 4, 0x7FFFFFFF),  # sint32
+    0x06: ("u4", 4, 0xFFFFFFFF),  # uint32
+    0x08: ("f4", 4, np.nan),  # float32
+    0x09: ("f8", 8, np.nan),  # float64
+    0x0A: ("u1", 1, 0x00),  # uint8z
+    0x0B: ("u2", 2, 0x0000),  # uint16z
+    0x0C: ("u4", 4, 0x00000000),  # uint32z
+    0x0D: ("u1", 1, 0xFF),  # byte
+    0x0E: ("i8", 8, 0x7FFFFFFFFFFFFFFF),  # sint64
+    0x0F: ("u8", 8, 0xFFFFFFFFFFFFFFFF),  # uint64
+    0x10: ("u8", 8, 0x0000000000000000),  # uint64z
+}
+
+
+# profile types that are plain numbers and not enums mapped to strings
+BASE_TYPES_BY_NAME = {
+    "enum",
+    "sint8",
+    "uint8",
+    "sint16",
+    "uint16",
+    "sint32",
+    "uint32",
+    "string",
+    "float32",
+    "float64",
+    "uint8z",
+    "uint16z",
+    "uint32z",
+    "byte",
+    "sint64",
+    "uint64",
+    "uint64z",
+    "bool",
+}
+
+
+@dataclass
+class _Definition:
+    global_num: int
+    byteorder: str
+    size: int
+    fields: list[tuple[int, int, int, int]]  # (number, offset, size, base type)
+    timestamp: struct.Struct | None
+    timestamp_offset: int
+
+
+def _read_definition(buf, pos: int, developer: bool) -> tuple[_Definition, int]:
+    byteorder = ">" if buf[pos + 1] == 1 else "<"
+    (global_num,) = struct.unpack_from(byteorder + "H", buf, pos + 2)
+    n_fields = buf[pos + 4]
+    pos += 5
+
+    fields = []
+    offset = 0
+    timestamp, timestamp_offset = None, 0
+    for _ in range(n_fields):
+        number, size, base_type = buf[pos], buf[pos + 1], buf[pos + 2] & 0x1F
+        if number == TIMESTAMP_FIELD_NUM and size == 4:
+            timestamp, timestamp_offset = struct.Struct(byteorder + "I"), offset
+        fields.append((number, offset, size, base_type))
+        offset += size
+        pos += 3
+
+    if developer:
+        n_developer_fields = buf[pos]
+        pos += 1
+        for _ in range(n_developer_fields):
+            offset += buf[pos + 1]
+            pos += 3
+
+    definition = _Definition(
+        global_num, byteorder, offset, fields, timestamp, timestamp_offset
+    )
+    return definition, pos
+
+
+def _scan_records(  # noqa: C901, hot loop kept in one function
+    buf, batch_size: int | None = None, mesg_num: int = RECORD_MESG_NUM
+) -> Iterator[list[tuple[_Definition, array, array]]]:
+    """Yields batches of at most `batch_size` records, all records if `None`.
+
+    A batch is a list of runs of consecutive records sharing one definition.
+    Each run holds the definition, the byte offsets of the record bodies and
+    the resolved timestamps (-1 if unknown), including compressed timestamps.
+    Records are the messages with global number `mesg_num`.
+    """
+    runs: list[tuple[_Definition, array, array]] = []
+    n_records = 0
+    definitions: dict[int, _Definition] = {}
+    last_timestamp = -1
+    pos = 0
+    while pos + 12 <= len(buf) and buf[pos + 8 : pos + 12] == b".FIT":
+        header_size = buf[pos]
+        (data_size,) = struct.unpack_from("<I", buf, pos + 4)
+        end = pos + header_size + data_size
+        pos += header_size
+        while pos < end:
+            header = buf[pos]
+            pos += 1
+            if header & 0x80:  # compressed timestamp header
+                definition = definitions[(header >> 5) & 0x03]
+                time_offset = header & 0x1F
+                timestamp = -1
+                if last_timestamp >= 0:
+                    timestamp = (last_timestamp & ~0x1F) + time_offset
+                    if time_offset < (last_timestamp & 0x1F):
+                        timestamp += 0x20
+                    last_timestamp = timestamp
+            elif header & 0x40:  # definition message
+                definitions[header & 0x0F], pos = _read_definition(
+                    buf, pos, developer=bool(header & 0x20)
+                )
+                continue
+            else:
+                definition = definitions[header & 0x0F]
+                timestamp = -1
+                if definition.timestamp is not None:
+                    (timestamp,) = definition.timestamp.unpack_from(
+                        buf, pos + definition.timestamp_offset
+                    )
+                    if timestamp == 0xFFFFFFFF:
+                        timestamp = -1
+                    else:
+                        last_timestamp = timestamp
+
+            if definition.global_num == mesg_num:
+                if not runs or runs[-1][0] is not definition:
+                    runs.append((definition, array("q"), array("q")))
+                runs[-1][1].append(pos)
+                runs[-1][2].append(timestamp)
+                n_records += 1
+                if n_records == batch_size:
+                    yield runs
+                    runs, n_records = [], 0
+            pos += definition.size
+        pos = end + 2  # skip file CRC
+    if n_records > 0:
+        yield runs
+
+
+def _decode_field(
+    raw: np.ndarray, offsets: np.ndarray, byteorder: str, field: tuple, profile: dict
+) -> pa.Array | None:
+    _, offset, size, base_type = field
+    if base_type not in BASE_TYPES:
+        return None
+    type_code, base_size, invalid = BASE_TYPES[base_type]
+    if size != base_size:  # arrays are not supported
+        return None
+
+    index = offsets[:, None] + np.arange(offset, offset + size)
+    # big-endian fields are swapped, pyarrow only takes native byte order
+    values = raw[index].view(byteorder + type_code).ravel()
+    values = values.astype(np.dtype(type_code), copy=False)
+    mask = np.isnan(values) if type_code[0] == "f" else values == invalid
+
+    field_type = profile.get("type")
+    scale, value_offset = profile.get("scale", [1]), profile.get("offset", [0])
+    if field_type == "date_time":
+        seconds = values.astype(np.int64) + FIT_EPOCH_S
+        return pa.array(seconds * 1_000_000, type=pa.timestamp("us"), mask=mask)
+    if field_type in Profile["types"] and field_type not in BASE_TYPES_BY_NAME:
+        labels = Profile["types"][field_type]
+        unique, inverse = np.unique(values, return_inverse=True)
+        names = pa.array([labels.get(int(value), str(value)) for value in unique])
+        return names.take(pa.array(inverse, mask=mask))
+    if len(scale) == 1 and (scale[0] != 1 or value_offset[0] != 0):
+        values = values / scale[0] - value_offset[0]
+    return pa.array(values, mask=mask)
+
+
+def _decode_run(
+    raw: np.ndarray,
+    definition: _Definition,
+    offsets: array,
+    timestamps: array,
+    fields: Collection[str] | None,
+) -> pl.DataFrame:
+    profile_fields = Profile["messages"][definition.global_num]["fields"]
+    offsets_np = np.frombuffer(offsets, dtype=np.int64)
+
+    columns = {}
+    if is_requested("timestamp", fields):
+        timestamps_np = np.frombuffer(timestamps, dtype=np.int64)
+        columns["timestamp"] = pa.array(
+            (timestamps_np + FIT_EPOCH_S) * 1_000_000,
+            type=pa.timestamp("us"),
+            mask=timestamps_np < 0,
+        )
+    for field in definition.fields:
+        number = field[0]
+        profile = profile_fields.get(number, {})
+        name = profile.get("name", str(number))
+        if number == TIMESTAMP_FIELD_NUM or not is_requested(name, fields):
+            continue
+        column = _decode_field(raw, offsets_np, definition.byteorder, field, profile)
+        if column is not None:
+            columns[name] = column
+    if len(columns) == 0:
+        return pl.DataFrame()
+    return pl.from_arrow(pa.table(columns))  # type: ignore
+
+
+def iter_records(
+    fit_file: str,
+    batch_size: int | None = None,
+    fields: Collection[str] | None = None,
+    mesg_num: int = RECORD_MESG_NUM,
+) -> Iterator[pl.DataFrame]:
+    """Yields the `record` messages of a .FIT file in batches.
+
+    The file is memory mapped and decoded batch by batch, so only one batch
+    of `batch_size` records is held in memory at a time. With `None`, all
+    records are returned in a single batch. If `fields` is given, only those
+    fields are decoded, by raw or canonical column name. Other messages can
+    be decoded by passing their global `mesg_num`.
+    """
+    with open(fit_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buf:
+        raw = np.frombuffer(buf, dtype=np.uint8)
+        try:
+            for runs in _scan_records(buf, batch_size, mesg_num):
+                frames = [
+                    _decode_run(raw, definition, offsets, timestamps, fields)
+                    for definition, offsets, timestamps in runs
+                ]
+                yield pl.concat(frames, how="diagonal")
+        except Exception as e:
+            # the frames of the traceback hold `raw`, and closing the mapping
+            # would raise a BufferError in place of the actual error
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            del raw
+
+
+def decode_records(
+    fit_file: str, fields: Collection[str] | None = None
+) -> pl.DataFrame:
+    """Decodes all `record` messages of a .FIT file into a dataframe."""
+    frames = list(iter_records(fit_file, fields=fields))
+    if len(frames) > 0:
+        return frames[0]
+    else:
+        return pl.DataFrame()
+
+
+def decode_file_id(fit_file: str) -> dict:
+    """Decodes the `file_id` message, e.g. manufacturer and product."""
+    batches = iter_records(fit_file, batch_size=1, mesg_num=FILE_ID_MESG_NUM)
+    try:
+        file_id = next(batches).drop("timestamp").row(0, named=True)
+    except StopIteration:
+        return {}
+    finally:
+        batches.close()
+    return {key: value for key, value in file_id.items() if value is not None}
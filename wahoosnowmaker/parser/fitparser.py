@@ -1,8 +1,11 @@
 import warnings
 from abc import ABC, abstractmethod
+from collections.abc import Collection, Iterator
 
 import polars as pl
 
+from wahoosnowmaker.parser.fitdecoder import decode_records, iter_records
+from wahoosnowmaker.parser.records_naming_mapping import is_requested
 from wahoosnowmaker.utils.logger import logger
 
 with warnings.catch_warnings():  # Garmin has a SyntaxWarning in the decoder.py file
@@ -22,31 +25,88 @@ class FitParsingError(Exception):
 
 
 class FitParser(ABC):
-    def fit_to_records_df(self, fit_file: str) -> pl.LazyFrame:
-        """Converts .FIT file to records dataframe."""
+    # bump whenever the output of the parser changes, invalidates the cache
+    version = "1"
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies parser, version and options, used as cache key."""
+        options = sorted(vars(self).items())
+        return f"{type(self).__name__}:{self.version}:{options}"
+
+    def fit_to_records_df(
+        self, fit_file: str, columns: Collection[str] | None = None
+    ) -> pl.LazyFrame:
+        """Converts .FIT file to records dataframe.
+
+        If `columns` is given, only fields whose raw or canonical name is in
+        `columns` are decoded.
+        """
         try:
-            return self._fit_to_records_df(fit_file)
+            return self._fit_to_records_df(fit_file, columns)
+        except Exception as e:
+            logger.error(f"[FIT Parsing] Error parsing {fit_file}: {e}")
+            raise FitParsingError(fit_file, str(e)) from e
+
+    def iter_record_batches(
+        self,
+        fit_file: str,
+        batch_size: int,
+        columns: Collection[str] | None = None,
+    ) -> Iterator[pl.DataFrame]:
+        """Yields the records of a .FIT file in batches of `batch_size` rows."""
+        try:
+            yield from self._iter_record_batches(fit_file, batch_size, columns)
         except Exception as e:
             logger.error(f"[FIT Parsing] Error parsing {fit_file}: {e}")
             raise FitParsingError(fit_file, str(e)) from e
 
     @abstractmethod
-    def _fit_to_records_df(self, fit_file: str) -> pl.LazyFrame:
+    def _fit_to_records_df(
+        self, fit_file: str, columns: Collection[str] | None
+    ) -> pl.LazyFrame:
         pass
 
+    def _iter_record_batches(
+        self, fit_file: str, batch_size: int, columns: Collection[str] | None
+    ) -> Iterator[pl.DataFrame]:
+        # Parsers that cannot stream decode everything and slice afterwards.
+        df = self._fit_to_records_df(fit_file, columns).collect()
+        yield from df.iter_slices(batch_size)
+
 
 class GarminFitSDKParser(FitParser):
-    def _fit_to_records_df(self, fit_file: str) -> pl.LazyFrame:
+    """Decodes with the Garmin FIT SDK.
+
+    The SDK always decodes every field, unrequested `columns` are skipped when
+    building the records. The expensive decoder options are opt-in.
+    """
+
+    def __init__(
+        self,
+        convert_types_to_strings: bool = False,
+        expand_sub_fields: bool = False,
+        expand_components: bool = False,
+        merge_heart_rates: bool = False,
+    ):
+        self.convert_types_to_strings = convert_types_to_strings
+        self.expand_sub_fields = expand_sub_fields
+        self.expand_components = expand_components
+        self.merge_heart_rates = merge_heart_rates
+
+    def _fit_to_records_df(
+        self, fit_file: str, columns: Collection[str] | None
+    ) -> pl.LazyFrame:
         stream = Stream.from_file(fit_file)
         decoder = Decoder(stream)
 
         messages, errors = decoder.read(
             apply_scale_and_offset=True,
             convert_datetimes_to_dates=True,
-            convert_types_to_strings=True,
-            expand_sub_fields=True,
-            expand_components=True,
-            merge_heart_rates=True,
+            convert_types_to_strings=self.convert_types_to_strings,
+            expand_sub_fields=self.expand_sub_fields,
+            expand_components=self.expand_components,
+            merge_heart_rates=self.merge_heart_rates,
             mesg_listener=None,
         )
         # logger.info(messages)
@@ -57,8 +117,26 @@ class GarminFitSDKParser(FitParser):
             {
                 str(key): value
                 for key, value in record.items()
-                if not isinstance(value, dict)
+                if not isinstance(value, dict) and is_requested(str(key), columns)
             }
             for record in records
         ]
         return pl.DataFrame(records).lazy()
+
+
+class ColumnarFitParser(FitParser):
+    """Decodes `record` messages straight into typed columns.
+
+    Faster and leaner than `GarminFitSDKParser`, but does not expand
+    components or sub fields, see `wahoosnowmaker.parser.fitdecoder`.
+    """
+
+    def _fit_to_records_df(
+        self, fit_file: str, columns: Collection[str] | None
+    ) -> pl.LazyFrame:
+        return decode_records(fit_file, columns).lazy()
+
+    def _iter_record_batches(
+        self, fit_file: str, batch_size: int, columns: Collection[str] | None
+    ) -> Iterator[pl.DataFrame]:
+        yield from iter_records(fit_file, batch_size, columns)
@@ -1,41 +1,282 @@
 import glob
+import multiprocessing
+import os
+from collections.abc import Collection, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
 
 import polars as pl
 
 from wahoosnowmaker import logger
+from wahoosnowmaker.namespace import Namespace
+from wahoosnowmaker.parser.cache import (
+    CacheSchemaError,
+    cache_file,
+    cache_key,
+    load_cached,
+    save_cached,
+    save_cached_batches,
+)
+from wahoosnowmaker.parser.fitparser import FitParser
 from wahoosnowmaker.parser.fitparser import GarminFitSDKParser as Parser
 from wahoosnowmaker.parser.pipes import (
     assign_file,
     compute_elapsed_seconds,
     convert_semicircles_to_lat_lon,
     drop_columns_all_nans,
+    enforce_schema,
     make_column_names_consistent,
+    name_files,
     parse_timestamp,
 )
 
 
+def pipe_records(records: pl.LazyFrame, start: datetime | None = None) -> pl.LazyFrame:
+    return (
+        records.pipe(make_column_names_consistent)
+        .pipe(parse_timestamp)
+        .pipe(convert_semicircles_to_lat_lon)
+        .pipe(compute_elapsed_seconds, start=start)
+        .pipe(enforce_schema)
+    )
+
+
+def with_required_columns(columns: Collection[str] | None) -> set[str] | None:
+    """Adds the columns every parsed file needs to a column selection."""
+    if columns is None:
+        return None
+    return set(columns) | {
+        Namespace.column_timestamp,
+        Namespace.column_elapsed_time,
+    }
+
+
+def parse_file(
+    fitfile: str,
+    parser: FitParser | None = None,
+    use_cache: bool = True,
+    columns: Collection[str] | None = None,
+    shared_folder: str | None = None,
+) -> pl.DataFrame | None:
+    """Parses a single .FIT file, returns `None` if parsing fails.
+
+    With `use_cache` the result is read from or written to the Parquet
+    sidecar of the file, see `wahoosnowmaker.parser.cache`, and shared
+    through `shared_folder` if given. With `columns`, only those columns are
+    decoded or read from the sidecar, and a partial result is never written
+    to the cache.
+    """
+    parser = parser or Parser()
+    columns = with_required_columns(columns)
+    try:
+        if use_cache:
+            key = cache_key(fitfile, parser)
+            df = load_cached(fitfile, key, columns, shared_folder)
+            if df is not None:
+                return df
+
+        df = (
+            parser.fit_to_records_df(fitfile, columns)
+            .pipe(pipe_records)
+            .collect()
+            .pipe(drop_columns_all_nans)
+        )
+        if use_cache and columns is None:
+            save_cached(fitfile, key, df, shared_folder)
+        return df
+    except Exception as e:
+        logger.error(f"Could not parse {fitfile}: {e}")
+        return None
+
+
+def _iter_parsed_batches(
+    fitfile: str, parser: FitParser, batch_size: int
+) -> Iterator[pl.DataFrame]:
+    start = None
+    for batch in parser.iter_record_batches(fitfile, batch_size):
+        df = batch.lazy().pipe(pipe_records, start=start).collect()
+        if start is None:
+            # records are written in order, the first batch holds the start
+            start = df[Namespace.column_timestamp].min()
+        yield df
+
+
+def stream_file_to_cache(
+    fitfile: str,
+    parser: FitParser | None = None,
+    batch_size: int = 2**16,
+    shared_folder: str | None = None,
+) -> str | None:
+    """Parses a .FIT file batch by batch into its Parquet sidecar.
+
+    Only one batch is held in memory at a time. Returns the path of the
+    sidecar, or `None` if parsing fails.
+    """
+    parser = parser or Parser()
+    try:
+        key = cache_key(fitfile, parser)
+        path = cache_file(fitfile, key)
+        if not os.path.exists(path):
+            try:
+                save_cached_batches(
+                    fitfile,
+                    key,
+                    _iter_parsed_batches(fitfile, parser, batch_size),
+                    shared_folder,
+                )
+            except CacheSchemaError as e:
+                logger.warning(f"{e}, parsing it in one go.")
+                parsed = parse_file(
+                    fitfile, parser, use_cache=True, shared_folder=shared_folder
+                )
+                if parsed is None:
+                    return None
+        if not os.path.exists(path):
+            # nothing is written for a file without records
+            logger.error(f"Could not parse {fitfile}: no records")
+            return None
+        return path
+    except Exception as e:
+        logger.error(f"Could not parse {fitfile}: {e}")
+        return None
+
+
+def _scan_cached(path: str, columns: Collection[str] | None) -> pl.LazyFrame:
+    lf = pl.scan_parquet(path)
+    if columns is not None:
+        lf = lf.select([c for c in lf.columns if c in columns])
+    return lf
+
+
+def _use_pool(fitfiles: list[str], n_workers: int) -> bool:
+    if n_workers <= 1 or len(fitfiles) <= 1:
+        return False
+    # spawned workers import polars and the parsers first, which takes longer
+    # than parsing a few small files in this process
+    size = sum(os.path.getsize(f) for f in fitfiles if os.path.isfile(f))
+    return size >= Namespace.parse_pool_min_bytes
+
+
+def _imap_files(task, fitfiles: list[str], args, n_workers: int) -> Iterator:
+    # results are yielded in order of `fitfiles`, each as soon as it is ready
+    if _use_pool(fitfiles, n_workers):
+        # Forking after polars started its thread pool can deadlock the workers
+        with ProcessPoolExecutor(
+            max_workers=min(n_workers, len(fitfiles)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            yield from pool.map(task, fitfiles, *args)
+    else:
+        yield from map(task, fitfiles, *args)
+
+
+def _map_files(task, fitfiles: list[str], args, n_workers: int) -> list:
+    return list(_imap_files(task, fitfiles, args, n_workers))
+
+
+def iter_parse_files(
+    fitfiles: list[str],
+    parser: FitParser | None = None,
+    n_workers: int = 1,
+    use_cache: bool = True,
+    shared_folder: str | None = None,
+) -> Iterator[pl.DataFrame | None]:
+    """Like `parse_files`, but yields the result of every file when it is ready."""
+    args = (repeat(parser), repeat(use_cache), repeat(None), repeat(shared_folder))
+    return _imap_files(parse_file, fitfiles, args, n_workers)
+
+
+def parse_files(
+    fitfiles: list[str],
+    parser: FitParser | None = None,
+    n_workers: int = 1,
+    use_cache: bool = True,
+    shared_folder: str | None = None,
+) -> list[pl.DataFrame | None]:
+    """Parses .FIT files with `parse_file`, in a process pool if requested.
+
+    The pool is only used for at least `Namespace.parse_pool_min_bytes`.
+    """
+    return list(iter_parse_files(fitfiles, parser, n_workers, use_cache, shared_folder))
+
+
+def scan_folder(
+    session_folder: str,
+    fit_ending: str = "/*.fit",
+    parser: FitParser | None = None,
+    n_workers: int = 1,
+    use_cache: bool = True,
+    batch_size: int | None = None,
+    columns: Collection[str] | None = None,
+) -> pl.LazyFrame:
+    """Parses all .FIT files of a folder into one lazy dataframe.
+
+    With `n_workers > 1` the files are parsed in a process pool, if they
+    are at least `Namespace.parse_pool_min_bytes` in total. The rows are
+    always ordered by file name, independent of the number of workers.
+
+    With `batch_size`, files are streamed into their Parquet sidecars and
+    scanned from there, which bounds the memory needed for parsing. This
+    always writes the cache.
+
+    With `columns`, only those columns (plus timestamp, elapsed time and
+    file) are decoded, see `parse_file`.
+
+    The `file` column is categorical, its codes are the positions of the
+    files in name order among the successfully parsed files.
+    """
+    parser = parser or Parser()
+    fitfiles = sorted(glob.glob(session_folder + fit_ending))
+    if batch_size is not None:
+        task, args = stream_file_to_cache, (repeat(parser), repeat(batch_size))
+    else:
+        task, args = parse_file, (repeat(parser), repeat(use_cache), repeat(columns))
+    results = _map_files(task, fitfiles, args, n_workers)
+
+    parsed = [
+        (fitfile, result)
+        for fitfile, result in zip(fitfiles, results, strict=True)
+        if result is not None
+    ]
+    if batch_size is not None:
+        columns = with_required_columns(columns)
+        lf_list = [_scan_cached(path, columns) for _, path in parsed]
+    else:
+        lf_list = [df.lazy() for _, df in parsed]
+    return concat_files(lf_list, [fitfile for fitfile, _ in parsed])
+
+
+def concat_files(lf_list: list[pl.LazyFrame], fitfiles: list[str]) -> pl.LazyFrame:
+    """Concatenates per-file frames and adds the categorical file column."""
+    if len(lf_list) == 0:
+        return pl.DataFrame().lazy()
+    return pl.concat(
+        [lf.pipe(assign_file, file_id=i) for i, lf in enumerate(lf_list)],
+        how="diagonal",
+    ).pipe(name_files, [os.path.basename(fitfile) for fitfile in fitfiles])
+
+
 def parse_folder(
     session_folder: str,
     fit_ending: str = "/*.fit",
+    parser: FitParser | None = None,
+    n_workers: int = 1,
+    use_cache: bool = True,
+    batch_size: int | None = None,
+    columns: Collection[str] | None = None,
 ) -> pl.DataFrame:
-    df_list = []
-    fitparser = Parser()
-    for fitfile in glob.glob(session_folder + fit_ending):
-        try:
-            df_list.append(
-                fitparser.fit_to_records_df(fitfile)
-                .collect()
-                .pipe(assign_file, file=fitfile)
-                .pipe(drop_columns_all_nans)
-                .pipe(make_column_names_consistent)
-                .pipe(parse_timestamp)
-                .pipe(convert_semicircles_to_lat_lon)
-                .pipe(compute_elapsed_seconds)
-            )
-        except Exception as e:
-            logger.error(f"Could not parse {fitfile}: {e}")
-
-    if len(df_list) > 0:
-        return pl.concat(df_list, how="diagonal")
-    else:
-        return pl.DataFrame()
+    """Parses all .FIT files of a folder into one dataframe."""
+    return (
+        scan_folder(
+            session_folder,
+            fit_ending,
+            parser,
+            n_workers,
+            use_cache,
+            batch_size,
+            columns,
+        )
+        .collect()
+        .pipe(drop_columns_all_nans)
+    )
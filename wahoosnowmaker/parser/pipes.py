@@ -1,63 +1,207 @@
-import os
+from datetime import datetime
 
 import polars as pl
+import pyarrow as pa
 
 from wahoosnowmaker.namespace import Namespace
-from wahoosnowmaker.parser.records_naming_mapping import Columns
+from wahoosnowmaker.parser.records_naming_mapping import (
+    ColumnAliases,
+    ColumnSchema,
+)
+
+# bump whenever the output of the pipes changes, invalidates the cache
+PIPELINE_VERSION = "4"
 
 
 def drop_columns_all_nans(_df: pl.DataFrame) -> pl.DataFrame:
-    return _df.drop([col.name for col in _df.select(pl.all().is_null()) if col.all()])
+    # Runs on the collected frame, null counts are cached per column.
+    return _df.drop([col.name for col in _df if col.null_count() == _df.height])
+
+
+def assign_file(_lf: pl.LazyFrame, file_id: int) -> pl.LazyFrame:
+    # Only the integer id is stored per row, see `name_files`.
+    return _lf.with_columns(
+        pl.lit(file_id, dtype=pl.UInt32).alias(Namespace.column_file)
+    )
 
 
-def assign_file(_df: pl.DataFrame, file: str):
-    return _df.with_columns(pl.lit(os.path.basename(file)).alias("file"))
+def name_files(_lf: pl.LazyFrame, file_names: list[str]) -> pl.LazyFrame:
+    """Turns file ids into a categorical column labelled with `file_names`.
+
+    The physical codes of the categorical are the file ids, each name is
+    stored once.
+    """
+
+    def to_categorical(file_ids: pl.Series) -> pl.Series:
+        names = pa.DictionaryArray.from_arrays(
+            file_ids.to_arrow(), pa.array(file_names, pa.large_string())
+        )
+        return pl.from_arrow(names)  # type: ignore
+
+    return _lf.with_columns(
+        pl.col(Namespace.column_file).map(to_categorical, return_dtype=pl.Categorical)
+    )
 
 
 def parse_timestamp(
-    _df: pl.DataFrame,
+    _lf: pl.LazyFrame,
     column: str = Namespace.column_timestamp,
     format: str = "%Y-%m-%dT%H:%M:%S.%fZ",
-) -> pl.DataFrame:
-    if _df[column].dtype == pl.Datetime:
-        return _df
+) -> pl.LazyFrame:
+    if _lf.schema[column] == pl.Datetime:
+        return _lf
     else:
-        return _df.with_columns(
+        return _lf.with_columns(
             [pl.col(column).str.strptime(pl.Datetime, format=format)]
         )
 
 
-def convert_semicircles_to_lat_lon(_df: pl.DataFrame):
-    if (
-        Namespace.column_latitude in _df.columns
-        and Namespace.column_longitude in _df.columns
-    ):
-        return _df.with_columns(
+def convert_semicircles_to_lat_lon(_lf: pl.LazyFrame) -> pl.LazyFrame:
+    columns = [
+        column
+        for column in [Namespace.column_latitude, Namespace.column_longitude]
+        if column in _lf.columns
+    ]
+    if len(columns) > 0:
+        return _lf.with_columns(
             [
-                pl.col(Namespace.column_latitude) * 180 / 2**31,
-                pl.col(Namespace.column_longitude) * 180 / 2**31,
+                # semicircles are int32, which overflows when multiplied
+                pl.col(column).cast(pl.Float64) * 180 / 2**31
+                for column in columns
             ]
         )
     else:
-        return _df
+        return _lf
 
 
-def compute_elapsed_seconds(_df: pl.DataFrame):
-    return _df.with_columns(
-        (pl.col(Namespace.column_timestamp) - pl.col(Namespace.column_timestamp).min())
+def compute_elapsed_seconds(
+    _lf: pl.LazyFrame, start: datetime | None = None
+) -> pl.LazyFrame:
+    # `start` is passed when a file is processed in batches
+    if start is None:
+        start_expr = pl.col(Namespace.column_timestamp).min()
+    else:
+        start_expr = pl.lit(start)
+    return _lf.with_columns(
+        (pl.col(Namespace.column_timestamp) - start_expr)
         .alias(Namespace.column_elapsed_time)
         .dt.seconds()
     )
 
 
-def make_column_names_consistent(_df: pl.DataFrame):
-    mapping = {}
-    print(_df)
-    for column in Columns:
-        for key, value in column.to_dict().items():
-            if key in _df.columns:
-                mapping[key] = value
+def make_column_names_consistent(_lf: pl.LazyFrame) -> pl.LazyFrame:
+    mapping = {
+        column: ColumnAliases[column]
+        for column in _lf.columns
+        if column in ColumnAliases and ColumnAliases[column] != column
+    }
     if len(mapping) > 0:
-        return _df.rename(mapping=mapping)
+        return _lf.rename(mapping=mapping)
+    else:
+        return _lf
+
+
+def enforce_schema(_lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Casts canonical columns to their declared dtype.
+
+    Other integer columns become Int64 and other float columns Float32, so
+    that every file ends up with the same dtypes.
+    """
+    casts = []
+    for column, dtype in _lf.schema.items():
+        if column in ColumnSchema:
+            target = ColumnSchema[column]
+        elif dtype in pl.INTEGER_DTYPES:
+            target = pl.Int64
+        elif dtype in pl.FLOAT_DTYPES:
+            target = pl.Float32
+        else:
+            continue
+        if dtype != target:
+            casts.append(pl.col(column).cast(target, strict=False))
+    if len(casts) > 0:
+        return _lf.with_columns(casts)
     else:
-        return _df
+        return _lf
+
+
+def align_files(
+    _lf: pl.LazyFrame,
+    resolution: float = 1.0,
+    on: str = Namespace.column_elapsed_time,
+    method: str = "linear",
+    max_gap: float | None = None,
+    by: str = Namespace.column_file,
+) -> pl.LazyFrame:
+    """Resamples every file onto a common grid of `on` with a step of `resolution`.
+
+    Grid points are multiples of `resolution` within the range of each file, so
+    rows of different files with the same `on` can be compared. `on` is the
+    elapsed time or another increasing column such as the distance. Values at a
+    grid point are taken from the samples before and after it: `"linear"`
+    interpolates numeric and datetime columns and takes other columns from the
+    previous sample, `"previous"` and `"nearest"` take whole samples. Grid
+    points in a gap of more than `max_gap` between samples are dropped.
+    """
+    if method not in Namespace.alignment_methods:
+        raise ValueError(f"Unknown alignment method {method}.")
+    schema = _lf.schema
+    columns = [column for column in schema if column not in (on, by)]
+    position = pl.col(on).cast(pl.Float64)
+    samples = _lf.filter(pl.col(on).is_not_null()).with_columns(position).sort(on)
+    grid = (
+        samples.groupby(by)
+        .agg(
+            pl.arange(
+                (position.min() / resolution).ceil().cast(pl.Int64),
+                (position.max() / resolution).floor().cast(pl.Int64) + 1,
+            ).alias(on)
+        )
+        .explode(on)
+        .select(pl.col(by), pl.col(on) * resolution)
+        .sort(on)
+    )
+
+    def neighbour(suffix: str) -> pl.LazyFrame:
+        return samples.select(
+            pl.col(by),
+            pl.col(on),
+            pl.col(on).alias(f"{on}\t{suffix}"),
+            *[pl.col(column).alias(f"{column}\t{suffix}") for column in columns],
+        )
+
+    aligned = grid.join_asof(
+        neighbour("previous"), on=on, by=by, strategy="backward"
+    ).join_asof(neighbour("next"), on=on, by=by, strategy="forward")
+
+    before_at, after_at = pl.col(f"{on}\tprevious"), pl.col(f"{on}\tnext")
+    take_next = (pl.col(on) - before_at) > (after_at - pl.col(on))
+    weight = (
+        pl.when(after_at > before_at)
+        .then((pl.col(on) - before_at) / (after_at - before_at))
+        .otherwise(0.0)
+    )
+
+    def value(column: str) -> pl.Expr:
+        dtype = schema[column]
+        before, after = pl.col(f"{column}\tprevious"), pl.col(f"{column}\tnext")
+        if method == "nearest":
+            result = pl.when(take_next).then(after).otherwise(before)
+        elif method == "linear" and (
+            dtype in pl.NUMERIC_DTYPES or dtype == pl.Datetime
+        ):
+            before = before.to_physical().cast(pl.Float64)
+            after = after.to_physical().cast(pl.Float64)
+            result = before + (after - before) * weight
+            if dtype in pl.INTEGER_DTYPES or dtype == pl.Datetime:
+                result = result.round(0).cast(pl.Int64)
+            result = result.cast(dtype)
+        else:
+            result = before
+        return result.alias(column)
+
+    if max_gap is not None:
+        aligned = aligned.filter((after_at - before_at) <= max_gap)
+    return aligned.select(
+        [pl.col(by), pl.col(on)] + [value(column) for column in columns]
+    ).sort([by, on])
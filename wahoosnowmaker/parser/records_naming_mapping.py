@@ -1,3 +1,5 @@
+from collections.abc import Collection
+
 import polars as pl
 
 from wahoosnowmaker.namespace import Namespace
@@ -42,6 +44,16 @@ Columns = [
         pl.Int16,
         ["temp_deg_c", "temperature"],
     ),
+    ColumnName(
+        Namespace.column_elapsed_time,
+        pl.Int32,
+        [],
+    ),
+    ColumnName(
+        Namespace.column_power,
+        pl.Int16,
+        ["pwr_w", "power"],
+    ),
     ColumnName(
         Namespace.column_distance,
         pl.Float64,
@@ -49,17 +61,17 @@ Columns = [
     ),
     ColumnName(
         Namespace.column_fractional_cadence,
-        pl.Float64,
+        pl.Float32,
         ["fractional_cad_rpm", "fractional_cadence"],
     ),
     ColumnName(
         Namespace.column_speed,
-        pl.Float64,
+        pl.Float32,
         ["spd_mps", "speed"],
     ),
     ColumnName(
         Namespace.column_enhanced_speed,
-        pl.Float64,
+        pl.Float32,
         ["enhanced_spd_mps", "enhanced_speed"],
     ),
     ColumnName(
@@ -84,12 +96,24 @@ Columns = [
     ),
     ColumnName(
         Namespace.column_altitude,
-        pl.Float64,
+        pl.Float32,
         ["elevation", "altitude"],
     ),
     ColumnName(
         Namespace.column_enhanced_altitude,
-        pl.Float64,
+        pl.Float32,
         ["enhanced_alt_m", "enhanced_altitude"],
     ),
 ]
+
+# alias -> canonical name
+ColumnAliases = {alias: column.name for column in Columns for alias in column.aliases}
+
+# canonical name -> dtype, shared by all files so that concatenating them
+# needs no type promotion
+ColumnSchema = {column.name: column.dtype for column in Columns}
+
+
+def is_requested(field: str, columns: Collection[str] | None) -> bool:
+    """Whether a raw field is requested by its raw or canonical name."""
+    return columns is None or field in columns or ColumnAliases.get(field) in columns
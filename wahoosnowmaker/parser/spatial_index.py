@@ -0,0 +1,123 @@
+"""Bounding boxes of the tracks of a dataset, per file and per chunk.
+
+The index is a two level tree. Every file is split into chunks of
+consecutive records, whose bounding boxes are small because a track moves
+little between records. A file's box is the union of its chunk boxes.
+Queries first test the file boxes and then only the chunks of intersecting
+files, so they never touch the records.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+
+from wahoosnowmaker.namespace import Namespace
+
+BOX_COLUMNS = ["lat_min", "lat_max", "lon_min", "lon_max"]
+
+
+def _box_aggregations(lat: str, lon: str) -> list[pl.Expr]:
+    return [
+        pl.col(lat).min().alias("lat_min"),
+        pl.col(lat).max().alias("lat_max"),
+        pl.col(lon).min().alias("lon_min"),
+        pl.col(lon).max().alias("lon_max"),
+    ]
+
+
+def _intersects(boxes: pl.DataFrame, bounds: tuple[float, ...]) -> np.ndarray:
+    lat_min, lat_max, lon_min, lon_max = bounds
+    return (
+        (boxes["lat_min"].to_numpy() <= lat_max)
+        & (boxes["lat_max"].to_numpy() >= lat_min)
+        & (boxes["lon_min"].to_numpy() <= lon_max)
+        & (boxes["lon_max"].to_numpy() >= lon_min)
+    )
+
+
+@dataclass
+class SpatialIndex:
+    # file, first and last chunk, bounding box
+    files: pl.DataFrame
+    # file, first and last row in the dataset frame, bounding box
+    chunks: pl.DataFrame
+
+    @classmethod
+    def build(
+        cls,
+        df: pl.DataFrame,
+        chunk_size: int = Namespace.spatial_index_chunk_size,
+        lat: str = Namespace.column_latitude,
+        lon: str = Namespace.column_longitude,
+        by: str = Namespace.column_file,
+    ) -> "SpatialIndex":
+        """Indexes the rows of `df` with a position, in chunks of `chunk_size`."""
+        chunks = (
+            df.select([by, lat, lon])
+            .with_row_count("row")
+            .filter(pl.col(lat).is_not_null() & pl.col(lon).is_not_null())
+            .groupby([by, pl.col("row") // chunk_size], maintain_order=True)
+            .agg(
+                [
+                    pl.col("row").min().alias("row_first"),
+                    pl.col("row").max().alias("row_last"),
+                ]
+                + _box_aggregations(lat, lon)
+            )
+            .select([by, "row_first", "row_last", *BOX_COLUMNS])
+        )
+        files = (
+            chunks.with_row_count("chunk")
+            .groupby(by, maintain_order=True)
+            .agg(
+                [
+                    pl.col("chunk").min().alias("chunk_first"),
+                    pl.col("chunk").max().alias("chunk_last"),
+                ]
+                + [
+                    pl.col("lat_min").min(),
+                    pl.col("lat_max").max(),
+                    pl.col("lon_min").min(),
+                    pl.col("lon_max").max(),
+                ]
+            )
+        )
+        return cls(files, chunks)
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """lat_min, lat_max, lon_min, lon_max of all tracks."""
+        return (
+            self.files["lat_min"].min(),
+            self.files["lat_max"].max(),
+            self.files["lon_min"].min(),
+            self.files["lon_max"].max(),
+        )
+
+    def query(self, bounds: tuple[float, float, float, float]) -> pl.DataFrame:
+        """Chunks whose bounding box intersects `bounds`, as in `bounds()`."""
+        files = self.files.filter(pl.Series(_intersects(self.files, bounds)))
+        if files.height == 0:
+            return self.chunks.head(0)
+        candidates = np.concatenate(
+            [
+                np.arange(first, last + 1)
+                for first, last in zip(
+                    files["chunk_first"], files["chunk_last"], strict=True
+                )
+            ]
+        )
+        chunks = self.chunks[candidates]
+        return chunks.filter(pl.Series(_intersects(chunks, bounds)))
+
+    def rows(self, bounds: tuple[float, float, float, float]) -> np.ndarray:
+        """Rows of the dataset frame in the chunks that intersect `bounds`."""
+        chunks = self.query(bounds)
+        return np.concatenate(
+            [
+                np.arange(first, last + 1)
+                for first, last in zip(
+                    chunks["row_first"], chunks["row_last"], strict=True
+                )
+            ]
+            + [np.empty(0, dtype=np.int64)]
+        )
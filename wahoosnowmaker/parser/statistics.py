@@ -0,0 +1,48 @@
+"""Summary statistics of the numeric columns of every file."""
+import polars as pl
+
+from wahoosnowmaker.namespace import Namespace
+
+# statistic -> aggregation of a column, as in pandas' describe
+STATISTICS = {
+    "count": lambda col: col.count(),
+    "mean": lambda col: col.mean(),
+    "std": lambda col: col.std(),
+    "min": lambda col: col.min(),
+    "25%": lambda col: col.quantile(0.25, "linear"),
+    "50%": lambda col: col.quantile(0.5, "linear"),
+    "75%": lambda col: col.quantile(0.75, "linear"),
+    "max": lambda col: col.max(),
+}
+
+
+def describe_by(df: pl.DataFrame, by: str = Namespace.column_file) -> pl.DataFrame:
+    """One row per group of `by` and statistic, one column per numeric column.
+
+    All statistics of all groups are computed in a single group-by.
+    """
+    columns = [
+        name
+        for name, dtype in df.schema.items()
+        if name != by and dtype in pl.NUMERIC_DTYPES
+    ]
+    wide = df.groupby(by, maintain_order=True).agg(
+        [
+            aggregate(pl.col(name).drop_nulls())
+            .cast(pl.Float64)
+            .alias(f"{name}\t{statistic}")
+            for name in columns
+            for statistic, aggregate in STATISTICS.items()
+        ]
+    )
+    return pl.concat(
+        [
+            wide.select(
+                # categoricals of separate selects cannot be concatenated
+                pl.col(by).cast(pl.Utf8),
+                pl.lit(statistic).alias("statistic"),
+                *[pl.col(f"{name}\t{statistic}").alias(name) for name in columns],
+            )
+            for statistic in STATISTICS
+        ]
+    )
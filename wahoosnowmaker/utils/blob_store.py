@@ -0,0 +1,97 @@
+"""Content-addressed store of uploaded .FIT files.
+
+Uploads are written in chunks to `<blob folder>/fit/<sha256>.fit` and
+hard-linked into dataset folders, so a file uploaded to several datasets is
+stored once. Parsed sidecars are shared the same way through
+`<blob folder>/parsed`, see `wahoosnowmaker.parser.cache`, so a duplicate
+upload is not parsed again. A blob that is not linked from any dataset
+anymore has a link count of one and is removed by `prune_blobs`.
+"""
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from typing import BinaryIO
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.namespace import Namespace
+
+
+def blob_file(digest: str, blob_folder: str = Namespace.blob_folder) -> str:
+    return os.path.join(blob_folder, "fit", f"{digest}.fit")
+
+
+def parsed_folder(blob_folder: str = Namespace.blob_folder) -> str:
+    """Absolute path of the shared parsed sidecars, see `parser.cache`."""
+    return os.path.abspath(os.path.join(blob_folder, "parsed"))
+
+
+def store_blob(
+    stream: BinaryIO,
+    path: str,
+    blob_folder: str = Namespace.blob_folder,
+    chunk_size: int = Namespace.blob_chunk_size,
+) -> str:
+    """Writes the content of `stream` to the store and `path`, returns its SHA-256.
+
+    A new blob is linked to `path` before it is moved into the store, so
+    `prune_blobs` never sees it unlinked.
+    """
+    for folder in ["fit", "parsed"]:
+        os.makedirs(os.path.join(blob_folder, folder), exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=os.path.join(blob_folder, "fit"), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            stream.seek(0)
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        blob = blob_file(digest.hexdigest(), blob_folder)
+        try:
+            os.link(blob, path)
+        except FileNotFoundError:  # a new content, or pruned in the meantime
+            _link(tmp, path)
+            os.replace(tmp, blob)
+        except OSError:
+            _link(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return digest.hexdigest()
+
+
+def _link(source: str, path: str) -> None:
+    """Hard-links `source` to `path`, or copies it if that is not possible."""
+    try:
+        os.link(source, path)
+    except OSError as e:
+        logger.warning(f"Could not link {source} to {path}, copying it: {e}")
+        shutil.copyfile(source, path)
+
+
+def prune_blobs(
+    blob_folder: str = Namespace.blob_folder,
+    tmp_grace: float = Namespace.blob_tmp_grace,
+) -> int:
+    """Removes blobs and parsed sidecars not linked from any dataset.
+
+    Temporary files of uploads are written to while they are stored, they
+    are only removed once they have not changed for `tmp_grace` seconds.
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(blob_folder, "*", "*")):
+        try:
+            stat = os.stat(path)
+            if path.endswith(".tmp"):
+                if time.time() - stat.st_mtime < tmp_grace:
+                    continue
+            elif stat.st_nlink > 1:
+                continue
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:  # e.g. removed by another session
+            continue
+    return removed
@@ -0,0 +1,165 @@
+"""Catalog of all datasets, so that listing them does not scan the folders.
+
+The catalog is a JSON file in the data folder with one entry per dataset
+folder: its name, its .FIT files and their sizes, its creation time, taken
+from the folder name, and whether it has been parsed. Entries are updated
+when a dataset is uploaded, renamed, parsed or deleted. Every update
+rewrites the file atomically. If the catalog is missing, it is rebuilt once
+from the folders.
+"""
+import glob
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+from wahoosnowmaker import logger
+from wahoosnowmaker.namespace import Namespace
+from wahoosnowmaker.utils.saveload import load_name, save_name
+
+STATUS_NOT_PARSED = "not parsed"
+STATUS_PARSING = "parsing"
+STATUS_PARSED = "parsed"
+STATUS_FAILED = "parsing failed"
+
+# sessions of the app are threads of one process
+_lock = threading.RLock()
+
+
+def catalog_file(data_folder: str = Namespace.data_folder) -> str:
+    return os.path.join(data_folder, Namespace.catalog_file_name)
+
+
+def created_at(folder: str, created: str | None = None) -> str:
+    """Creation time of a dataset, from its folder name if it is a timestamp.
+
+    Otherwise `created`, if known, or the time the folder was last changed.
+    """
+    try:
+        return datetime.fromisoformat(os.path.basename(_key(folder))).isoformat()
+    except ValueError:
+        # the ctime of a folder changes whenever a file is added to it
+        return created or datetime.fromtimestamp(os.path.getctime(folder)).isoformat()
+
+
+def scan_dataset(
+    folder: str, status: str = STATUS_NOT_PARSED, created: str | None = None
+) -> dict:
+    """Catalog entry of a dataset folder, read from the filesystem."""
+    files = sorted(glob.glob(os.path.join(folder, "*.fit")))
+    sizes = [os.path.getsize(file) for file in files]
+    return {
+        "folder": folder,
+        "name": load_name(folder),
+        "files": [os.path.basename(file) for file in files],
+        "sizes": sizes,
+        "size": sum(sizes),
+        "created": created_at(folder, created),
+        "status": status,
+    }
+
+
+def _key(folder: str) -> str:
+    return os.path.normpath(folder)
+
+
+def _save(catalog: dict[str, dict], data_folder: str) -> None:
+    path = catalog_file(data_folder)
+    with open(path + ".tmp", "w") as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def rebuild_catalog(data_folder: str = Namespace.data_folder) -> dict[str, dict]:
+    """Scans all dataset folders and stores them as the catalog."""
+    with _lock:
+        catalog = {}
+        for folder in glob.glob(os.path.join(data_folder, "*")):
+            if os.path.isdir(folder):
+                catalog[_key(folder)] = scan_dataset(_key(folder))
+        os.makedirs(data_folder, exist_ok=True)
+        _save(catalog, data_folder)
+        return catalog
+
+
+def load_catalog(data_folder: str = Namespace.data_folder) -> dict[str, dict]:
+    """Entries of all datasets by folder, rebuilt if there is no catalog."""
+    with _lock:
+        try:
+            with open(catalog_file(data_folder)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return rebuild_catalog(data_folder)
+        except Exception as e:
+            logger.warning(f"Could not read catalog of {data_folder}: {e}")
+            return rebuild_catalog(data_folder)
+
+
+def list_datasets(
+    data_folder: str = Namespace.data_folder,
+    page: int = 0,
+    page_size: int = Namespace.catalog_page_size,
+) -> tuple[list[dict], int, int]:
+    """Entries of a page of datasets with files, newest first.
+
+    Also returns the page, which is the last one if `page` is past the end,
+    and the number of pages.
+    """
+    entries = [entry for entry in load_catalog(data_folder).values() if entry["files"]]
+    entries.sort(key=lambda entry: entry["created"], reverse=True)
+    n_pages = max(1, -(-len(entries) // page_size))
+    page = min(page, n_pages - 1)
+    return entries[page * page_size : (page + 1) * page_size], page, n_pages
+
+
+def update_dataset(
+    folder: str, data_folder: str = Namespace.data_folder, **changes
+) -> dict:
+    """Rescans a dataset folder, e.g. after an upload, and stores its entry.
+
+    Pass `changes` to set fields without scanning, e.g. `status`.
+    """
+    with _lock:
+        catalog = load_catalog(data_folder)
+        entry = catalog.get(_key(folder))
+        if entry is not None and changes:
+            if all(entry.get(field) == value for field, value in changes.items()):
+                # e.g. the status of a dataset on every rerun of the page
+                return entry
+        else:
+            status = entry["status"] if entry else STATUS_NOT_PARSED
+            created = entry["created"] if entry else None
+            entry = scan_dataset(_key(folder), status, created)
+        entry.update(changes)
+        catalog[_key(folder)] = entry
+        _save(catalog, data_folder)
+        return entry
+
+
+def rename_dataset(
+    folder: str, name: str, data_folder: str = Namespace.data_folder
+) -> None:
+    """Stores the name of a dataset in its folder and in the catalog."""
+    save_name(folder, name)
+    update_dataset(folder, data_folder, name=load_name(folder))
+
+
+def delete_dataset(folder: str, data_folder: str = Namespace.data_folder) -> None:
+    """Removes a dataset folder and its catalog entry."""
+    with _lock:
+        shutil.rmtree(folder, ignore_errors=True)
+        catalog = load_catalog(data_folder)
+        if catalog.pop(_key(folder), None) is not None:
+            _save(catalog, data_folder)
+
+
+def set_status(
+    folder: str, status: str, data_folder: str = Namespace.data_folder
+) -> None:
+    """Records whether a dataset has been parsed, if it is in the catalog."""
+    with _lock:
+        if not os.path.exists(catalog_file(data_folder)):
+            return
+        if _key(folder) in load_catalog(data_folder):
+            update_dataset(folder, data_folder, status=status)
@@ -0,0 +1,134 @@
+"""Writes synthetic .FIT activity files for tests and benchmarks.
+
+The files contain a `file_id` message, `record` messages with the requested
+fields and an `event` message every ten minutes, all with valid CRCs.
+Messages can be written big-endian and records with compressed timestamps.
+"""
+import struct
+from collections.abc import Callable, Collection
+
+import numpy as np
+
+SEMICIRCLES_PER_DEGREE = 2**31 / 180
+
+# name -> (field number, base type, struct code, value at time t [s])
+RecordField = tuple[int, int, str, Callable[[np.ndarray], np.ndarray]]
+RECORD_FIELDS: dict[str, RecordField] = {
+    "position_lat": (
+        0,
+        0x85,
+        "i",
+        lambda t: (48.0 + 0.01 * np.sin(t / 600)) * SEMICIRCLES_PER_DEGREE,
+    ),
+    "position_long": (
+        1,
+        0x85,
+        "i",
+        lambda t: (11.0 + 0.01 * np.cos(t / 600)) * SEMICIRCLES_PER_DEGREE,
+    ),
+    "altitude": (2, 0x84, "H", lambda t: (500 + 500 + 50 * np.sin(t / 300)) * 5),
+    "heart_rate": (3, 0x02, "B", lambda t: 130 + 20 * np.sin(t / 120)),
+    "cadence": (4, 0x02, "B", lambda t: 85 + 5 * np.sin(t / 30)),
+    "distance": (5, 0x86, "I", lambda t: t * 8.0 * 100),
+    "speed": (6, 0x84, "H", lambda t: (8.0 + np.sin(t / 60)) * 1000),
+    "power": (7, 0x84, "H", lambda t: 220 + 80 * np.sin(t / 45)),
+    "temperature": (13, 0x01, "b", lambda t: 18 + 4 * np.sin(t / 3600)),
+}
+
+_CRC_TABLE = [
+    0x0000,
+    0xCC01,
+    0xD801,
+    0x1400,
+    0xF001,
+    0x3C00,
+    0x2800,
+    0xE401,
+    0xA001,
+    0x6C00,
+    0x7800,
+    0xB401,
+    0x5000,
+    0x9C01,
+    0x8801,
+    0x4400,
+]
+
+
+def _crc(data: bytes, crc: int = 0) -> int:
+    for byte in data:
+        for nibble in (byte & 0xF, byte >> 4):
+            tmp = _CRC_TABLE[crc & 0xF]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ _CRC_TABLE[nibble]
+    return crc
+
+
+def _definition(
+    local: int, global_num: int, fields: list[tuple[int, int, int]], arch: int = 0
+):
+    byteorder = ">" if arch == 1 else "<"
+    header = struct.pack("<BBB", 0x40 | local, 0, arch)
+    header += struct.pack(byteorder + "HB", global_num, len(fields))
+    return header + b"".join(struct.pack("<BBB", *field) for field in fields)
+
+
+def write_fit_file(
+    path: str,
+    n_records: int = 3600,
+    sample_rate: int = 1,
+    fields: Collection[str] | None = None,
+    start: int = 1_000_000_000,
+    arch: int = 0,
+    compressed_timestamps: bool = False,
+) -> None:
+    """Writes an activity with `n_records` records at `sample_rate` Hz.
+
+    `fields` selects the record fields, see `RECORD_FIELDS`, all by default.
+    `start` is the FIT timestamp of the first record. `arch` 1 writes the
+    messages big-endian. With `compressed_timestamps`, all records but the
+    first have their timestamp in the record header.
+    """
+    fields = list(RECORD_FIELDS) if fields is None else list(fields)
+    record_fields = [RECORD_FIELDS[name] for name in fields]
+    byteorder = ">" if arch == 1 else "<"
+    codes = "".join(code for _, _, code, _ in record_fields)
+    record = struct.Struct(byteorder + "BI" + codes)
+    compressed_record = struct.Struct(byteorder + "B" + codes)
+    event = struct.Struct(byteorder + "BIBB")
+
+    definitions = [
+        (number, struct.calcsize(code), base_type)
+        for number, base_type, code, _ in record_fields
+    ]
+    body = bytearray()
+    body += _definition(
+        0, 0, [(0, 1, 0x00), (1, 2, 0x84), (2, 2, 0x84), (4, 4, 0x86)], arch
+    )
+    body += struct.pack(byteorder + "BBHHI", 0, 4, 32, 1, start)  # activity by wahoo
+    body += _definition(1, 20, [(253, 4, 0x86)] + definitions, arch)
+    body += _definition(2, 21, [(253, 4, 0x86), (0, 1, 0x00), (1, 1, 0x00)], arch)
+    if compressed_timestamps:
+        body += _definition(3, 20, definitions, arch)
+
+    seconds = np.arange(n_records) // sample_rate
+    columns = [
+        np.round(value(seconds.astype(float))).astype(np.int64)
+        for _, _, _, value in record_fields
+    ]
+    for i in range(n_records):
+        timestamp = start + int(seconds[i])
+        values = [int(column[i]) for column in columns]
+        if compressed_timestamps and i > 0:
+            header = 0x80 | 3 << 5 | timestamp & 0x1F
+            body += compressed_record.pack(header, *values)
+        else:
+            body += record.pack(1, timestamp, *values)
+        if i % (600 * sample_rate) == 0:
+            body += event.pack(2, timestamp, 0, 4)  # timer event
+
+    header = struct.pack("<BBHI4s", 14, 0x20, 2132, len(body), b".FIT")
+    header += struct.pack("<H", _crc(header))
+    data = header + bytes(body)
+    with open(path, "wb") as f:
+        f.write(data + struct.pack("<H", _crc(data)))